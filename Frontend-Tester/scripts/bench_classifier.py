@@ -0,0 +1,85 @@
+import os, sys, glob, time, argparse, subprocess
+import cv2
+import numpy as np
+
+# Make the app modules importable when run from the Frontend-Tester directory
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC_DIR)
+
+from check_conv_ghibli import classifier_input
+from tflite_classifier import KERAS_CLASSIFIER_PATH, TFLITE_CLASSIFIER_PATH
+
+# Each backend is imported and loaded in a fresh interpreter, so import time is measured too
+STARTUP_SNIPPETS = {
+    "keras": (
+        "from tensorflow.keras.models import load_model; "
+        f"load_model({KERAS_CLASSIFIER_PATH!r})"
+    ),
+    "tflite": (
+        "from tflite_classifier import TFLiteClassifier; "
+        f"TFLiteClassifier({TFLITE_CLASSIFIER_PATH!r})"
+    ),
+}
+
+
+def startup_time(backend, runs=3):
+    """Median wall time of a fresh Python process that imports and loads one backend."""
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", STARTUP_SNIPPETS[backend]], check=True,
+                       cwd=os.getcwd(), env=dict(os.environ, PYTHONPATH=SRC_DIR, TF_CPP_MIN_LOG_LEVEL="2"))
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+
+def parity(image_dirs, limit=200):
+    """Compares Keras and TFLite scores and verdicts on the same images."""
+    from tensorflow.keras.models import load_model
+    from tflite_classifier import TFLiteClassifier
+
+    paths = sorted(
+        p for d in image_dirs for ext in ("*.jpg", "*.jpeg", "*.png", "*.JPG")
+        for p in glob.glob(os.path.join(d, ext))
+    )[:limit]
+    inputs = [classifier_input(im) for im in (cv2.imread(p) for p in paths) if im is not None]
+    if not inputs:
+        print(f"No images found in {image_dirs}")
+        return
+
+    keras_model = load_model(KERAS_CLASSIFIER_PATH)
+    tflite_model = TFLiteClassifier(TFLITE_CLASSIFIER_PATH)
+
+    keras_scores, tflite_scores, latencies = [], [], {"keras": [], "tflite": []}
+    for x in inputs:
+        batch = x[None]
+        start = time.perf_counter()
+        keras_scores.append(float(keras_model(batch, training=False).numpy().reshape(-1)[0]))
+        latencies["keras"].append(time.perf_counter() - start)
+        start = time.perf_counter()
+        tflite_scores.append(float(tflite_model.predict_batch(batch)[0]))
+        latencies["tflite"].append(time.perf_counter() - start)
+
+    keras_scores, tflite_scores = np.array(keras_scores), np.array(tflite_scores)
+    agreement = np.mean((keras_scores > 0.5) == (tflite_scores > 0.5))
+    print(f"Parity on {len(inputs)} images: verdict agreement {agreement:.3%}, "
+          f"mean |score diff| {np.abs(keras_scores - tflite_scores).mean():.4f}, "
+          f"max {np.abs(keras_scores - tflite_scores).max():.4f}")
+    for name, lat in latencies.items():
+        lat = np.array(lat[1:] or lat) * 1000  # First call excluded as warm-up
+        print(f"{name:>8}: mean {lat.mean():7.2f} ms | p95 {np.percentile(lat, 95):7.2f} ms per image")
+    return agreement
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check TFLite vs Keras classifier parity and startup time.")
+    parser.add_argument("--images", nargs="+", default=["uploads", "ghibli images"], help="Directories of test images")
+    parser.add_argument("--limit", type=int, default=200, help="Maximum number of images")
+    parser.add_argument("--min-agreement", type=float, default=0.98, help="Fail if verdict agreement is lower")
+    args = parser.parse_args()
+
+    for backend in STARTUP_SNIPPETS:
+        print(f"{backend:>8}: startup (import + load) {startup_time(backend):.2f} s")
+    agreement = parity(args.images, args.limit)
+    if agreement is not None and agreement < args.min_agreement:
+        sys.exit(f"Verdict agreement {agreement:.3%} is below {args.min_agreement:.0%}")
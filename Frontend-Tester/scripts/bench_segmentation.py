@@ -0,0 +1,63 @@
+import os, sys, glob, time, argparse
+import cv2
+import numpy as np
+
+# Make the app modules importable when run from the Frontend-Tester directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from segmentation_engine import get_engine
+
+
+def mask_iou(mask_a, mask_b):
+    """Intersection over union of two boolean masks (1.0 if both are empty)."""
+    union = np.logical_or(mask_a, mask_b).sum()
+    if union == 0:
+        return 1.0
+    return np.logical_and(mask_a, mask_b).sum() / union
+
+
+def benchmark(image_dir, reference="detectron2", candidates=("onnx",), limit=20):
+    """Times every backend on the same images and compares their masks to the reference backend."""
+    paths = sorted(
+        p for ext in ("*.jpg", "*.jpeg", "*.png", "*.JPG")
+        for p in glob.glob(os.path.join(image_dir, ext))
+    )[:limit]
+    if not paths:
+        print(f"No images found in {image_dir}")
+        return
+
+    images = [im for im in (cv2.imread(p) for p in paths) if im is not None]
+    backends = (reference,) + tuple(candidates)
+    latencies = {name: [] for name in backends}
+    ious = {name: [] for name in candidates}
+
+    for name in backends:
+        # Warm-up run so model loading is not counted as inference latency
+        get_engine(name).predict_mask(images[0])
+
+    for im_bgr in images:
+        masks = {}
+        for name in backends:
+            start = time.perf_counter()
+            masks[name] = get_engine(name).predict_mask(im_bgr)
+            latencies[name].append(time.perf_counter() - start)
+        for name in candidates:
+            ious[name].append(mask_iou(masks[reference], masks[name]))
+
+    print(f"Benchmarked {len(images)} images from {image_dir}")
+    for name in backends:
+        lat = np.array(latencies[name]) * 1000
+        line = f"{name:>12}: mean {lat.mean():8.1f} ms | p50 {np.percentile(lat, 50):8.1f} ms | p95 {np.percentile(lat, 95):8.1f} ms"
+        if name in ious:
+            line += f" | mean IoU vs {reference} {np.mean(ious[name]):.3f}"
+        print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare segmentation engines on latency and mask IoU.")
+    parser.add_argument("--images", default="uploads", help="Directory of test images")
+    parser.add_argument("--limit", type=int, default=20, help="Maximum number of images")
+    parser.add_argument("--candidates", nargs="+", default=["onnx"], help="Engines to compare against detectron2 (onnx, yolo_ghibli, keying)")
+    args = parser.parse_args()
+
+    benchmark(args.images, candidates=args.candidates, limit=args.limit)
@@ -2,6 +2,11 @@
 import os, subprocess
 import streamlit as st
 
+from segmentation_engine import warm_up_routes
+from seg_workers import SEG_WORKERS, get_pool
+from fonts import preload_fonts
+import sticker_store
+from caption_layout import MIN_FONT_SIZE, MAX_FONT_SIZE
 from main import setup_environment, setup_logging, load_classifier_model, process_sticker_from_image, process_sticker_from_text
 
 # Set up environment and directories
@@ -15,6 +20,28 @@ log_filename = setup_logging()
 # but we load it here as it's part of the setup.
 is_normal_classifier = load_classifier_model()
 
+@st.cache_resource
+def start_background_work():
+    """
+    Process-wide start-up work. Streamlit reruns this script on every interaction;
+    st.cache_resource makes the body run only once per server process.
+    """
+    # Build the segmentation model in the background so the UI renders immediately.
+    # With SEG_WORKERS set, the worker processes preload it instead.
+    if SEG_WORKERS > 0:
+        get_pool()
+    else:
+        warm_up_routes()
+
+    # Parse the bundled fonts once per process, at every size the caption layout can pick
+    preload_fonts(range(MIN_FONT_SIZE, MAX_FONT_SIZE + 1))
+
+    # Periodically reclaim stickers no session has leased recently
+    sticker_store.start_collector()
+    return True
+
+start_background_work()
+
 subprocess.run(["python3", "tracking/app.py"])
 
 # Streamlit UI
@@ -109,6 +136,11 @@ font_files = {
 st.markdown("### Choose Font Style:")
 selected_font = st.radio("Select Font Style:", list(font_options.keys()), horizontal=True)
 
+# Static or animated sticker
+animation_options = {"None": None, "Caption pop-in": "pop", "Subject wobble": "wobble"}
+selected_animation = st.radio("Animation:", list(animation_options.keys()), horizontal=True)
+animation = animation_options[selected_animation]
+
 # Load selected font (remains the same)
 font_url = font_options[selected_font]
 st.markdown(f'<link href="{font_url}" rel="stylesheet">', unsafe_allow_html=True)
@@ -139,7 +171,8 @@ if st.button("Generate Sticker"):
                 selected_font,
                 font_files,
                 is_normal_classifier,
-                log_filename
+                log_filename,
+                animation
             )
         elif not uploaded_file:
             st.warning("Please upload an image.")
@@ -155,7 +188,8 @@ if st.button("Generate Sticker"):
                 color,
                 selected_font,
                 font_files,
-                log_filename
+                log_filename,
+                animation
             )
         elif not text_for_image:
             st.warning("Please enter text for image generation.")
@@ -166,14 +200,18 @@ if st.button("Generate Sticker"):
     # This part executes if an output_path was successfully returned.
     if output_path and os.path.exists(output_path):
         st.success("Sticker generated successfully! 🎉")
-        st.image(output_path, caption="Generated Sticker", use_container_width=True)
+        # Lease the shown sticker so garbage collection leaves it alone while the session is likely open
+        sticker_store.lease(os.path.splitext(os.path.basename(output_path))[0])
+        # Read the sticker once and serve both the preview and the download from memory
         with open(output_path, "rb") as file:
-            st.download_button(
-                label="Download Sticker",
-                data=file,
-                file_name="sticker.webp",
-                mime="image/webp"
-            )
+            sticker_bytes = file.read()
+        st.image(sticker_bytes, caption="Generated Sticker", use_container_width=True)
+        st.download_button(
+            label="Download Sticker",
+            data=sticker_bytes,
+            file_name="sticker.webp",
+            mime="image/webp"
+        )
     elif output_path is None:
          # Display an error if processing failed and output_path is None
          st.error("Failed to generate sticker. Please check your inputs and try again.")
\ No newline at end of file
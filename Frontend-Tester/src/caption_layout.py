@@ -0,0 +1,148 @@
+from collections import namedtuple
+from functools import lru_cache
+
+from fonts import load_font, text_length, font_cache
+
+# --- Caption layout configuration ---
+# Captions are fitted into a band at the top of the sticker: the largest font size whose
+# word-wrapped lines fit the band is found by binary search. Word widths are summed from
+# per-glyph advances measured once at REFERENCE_SIZE and scaled to each probed size; only
+# the chosen layout's lines are measured at their real size.
+MIN_FONT_SIZE = 18
+MAX_FONT_SIZE = 72
+REFERENCE_SIZE = MAX_FONT_SIZE
+ESTIMATE_MARGIN = 0.1  # Scaled estimates stay within ~7% of real widths; closer lines are measured
+MAX_LINES = 3
+LINE_SPACING = 0.15  # Extra space between lines, as a fraction of the font size
+MAX_CAPTION_HEIGHT_RATIO = 0.3  # Share of the sticker height the caption band may take
+
+CaptionLayout = namedtuple("CaptionLayout", ["font_size", "lines", "line_height", "height"])
+
+
+@font_cache
+@lru_cache(maxsize=None)
+def line_height(font_name, size):
+    """Height of one line of text (ascent + descent + spacing) for a font and size."""
+    ascent, descent = load_font(font_name, size).getmetrics()
+    return ascent + descent + int(size * LINE_SPACING)
+
+
+@font_cache
+@lru_cache(maxsize=4096)
+def glyph_advance(char, font_name):
+    """Advance width of one character at REFERENCE_SIZE, measured once per process."""
+    return text_length(char, font_name, REFERENCE_SIZE)
+
+
+def word_widths(caption, font_name):
+    """
+    Estimates the widths of the caption's words and of a space at REFERENCE_SIZE by
+    summing per-glyph advances, so a new caption needs no font calls once its characters
+    have been seen. Kerning is ignored here and accounted for by fit_caption's final check.
+
+    Returns:
+        tuple: (words, widths, space_width) with widths in pixels at REFERENCE_SIZE.
+    """
+    words = caption.split()
+    return (words, [sum(glyph_advance(char, font_name) for char in word) for word in words],
+            glyph_advance(" ", font_name))
+
+
+def wrap_text(caption, font_name, size, max_width, measured=None):
+    """
+    Greedily wraps a caption into lines no wider than max_width.
+
+    Word widths are estimated once at REFERENCE_SIZE (see word_widths) and scaled to
+    size, so probing another size costs no font calls. Hinting and kerning make the
+    scaled widths approximate; fit_caption checks the final lines with real measurements.
+
+    Args:
+        measured (tuple): word_widths(caption, font_name), if already computed.
+
+    Returns:
+        list[str]: The wrapped lines, or None if a single word is wider than max_width.
+    """
+    words, widths, space = measured or word_widths(caption, font_name)
+    scale = size / REFERENCE_SIZE
+    space *= scale
+    lines, current, current_width = [], [], 0.0
+    for word, word_width in zip(words, widths):
+        word_width *= scale
+        if word_width > max_width:
+            return None
+        if current and current_width + space + word_width > max_width:
+            lines.append(" ".join(current))
+            current, current_width = [word], word_width
+        else:
+            current_width += (space if current else 0) + word_width
+            current.append(word)
+    if current:
+        lines.append(" ".join(current))
+    return lines
+
+
+def _layout_at(caption, font_name, size, max_width, max_height, max_lines, measured):
+    """Returns the layout at one size, or None if it does not fit the box."""
+    lines = wrap_text(caption, font_name, size, max_width, measured)
+    if lines is None or len(lines) > max_lines:
+        return None
+    height = line_height(font_name, size) * len(lines)
+    if height > max_height:
+        return None
+    return CaptionLayout(size, lines, line_height(font_name, size), height)
+
+
+def _fits(layout, font_name, max_width):
+    """
+    Checks a layout's lines against max_width with real (hinted, kerned) measurements.
+    Lines whose estimate is clearly narrower than max_width are not measured.
+    """
+    scale = layout.font_size / REFERENCE_SIZE
+    for line in layout.lines:
+        estimate = sum(glyph_advance(char, font_name) for char in line) * scale
+        if estimate > max_width * (1 - ESTIMATE_MARGIN) and text_length(line, font_name, layout.font_size) > max_width:
+            return False
+    return True
+
+
+@font_cache
+@lru_cache(maxsize=1024)
+def fit_caption(caption, font_name, max_width, max_height, max_lines=MAX_LINES):
+    """
+    Finds the largest font size at which the caption fits the box, wrapping as needed.
+
+    Args:
+        caption (str): The caption text.
+        font_name (str): Bundled font name, e.g. "Bangers".
+        max_width (int): Available width in pixels.
+        max_height (int): Available height in pixels.
+        max_lines (int): Maximum number of wrapped lines.
+
+    Returns:
+        CaptionLayout: font_size, lines, line_height and total height. If nothing fits,
+                       the layout at MIN_FONT_SIZE is returned and may overflow.
+    """
+    measured = word_widths(caption, font_name)
+    best = None
+    lo, hi = MIN_FONT_SIZE, MAX_FONT_SIZE
+    while lo <= hi:
+        mid = (lo + hi) // 2
+        layout = _layout_at(caption, font_name, mid, max_width, max_height, max_lines, measured)
+        if layout is not None:
+            best, lo = layout, mid + 1
+        else:
+            hi = mid - 1
+
+    # The search ran on scaled widths; step down while the real lines are too wide
+    while best is not None and not _fits(best, font_name, max_width):
+        size = best.font_size - 1
+        best = None
+        while best is None and size >= MIN_FONT_SIZE:
+            best = _layout_at(caption, font_name, size, max_width, max_height, max_lines, measured)
+            size -= 1
+
+    if best is None:
+        lines = wrap_text(caption, font_name, MIN_FONT_SIZE, max_width, measured) or [caption]
+        height = line_height(font_name, MIN_FONT_SIZE) * len(lines)
+        best = CaptionLayout(MIN_FONT_SIZE, lines, line_height(font_name, MIN_FONT_SIZE), height)
+    return best
@@ -2,9 +2,8 @@ import os
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
 
 import logging
-import numpy as np
-from tensorflow.keras.models import load_model
-from tensorflow.keras.preprocessing import image
+
+from preprocess import prepare, classifier_tensor
 
 def is_normal(img_path, mobilenet_model, log_filename):
     """Generates a WhatsApp-compatible sticker with caption"""
@@ -17,17 +16,13 @@ def is_normal(img_path, mobilenet_model, log_filename):
             datefmt="%Y-%m-%d %H:%M:%S"
         )
 
-    mobilenet_img_size = (224, 224)
-
     """Predicts if an image is 'normal' or 'ghibli' using the loaded MobileNet model."""
     try:
         if mobilenet_model is None:
             return None              # Model not loaded, cannot predict
 
-        img = image.load_img(img_path, target_size=mobilenet_img_size)
-        img_array = image.img_to_array(img)
-        img_array = np.expand_dims(img_array, axis=0)
-        img_array = img_array / 255.0
+        # One decode, in JPEG draft mode, straight to the float32 classifier input
+        img_array = prepare(img_path).classifier_input[None]
 
         prediction = mobilenet_model.predict(img_array)
         if prediction[0][0] > 0.5:
@@ -38,12 +33,20 @@ def is_normal(img_path, mobilenet_model, log_filename):
         logging.error(f"Error during image classification: {e}")
         return None
 
+def classifier_input(im_bgr):
+    """
+    Prepares a BGR array as one float32 classifier input of shape (224, 224, 3).
+    Mirrors load_img(target_size=(224, 224)): nearest-neighbour resize, RGB, scaled to [0, 1].
+    """
+    return classifier_tensor(im_bgr, bgr=True)
+
 if __name__ == "__main__":
     # Example usage
     log_filename = "logs\studio_2025-04-14_05-38-22.log"
     mobilenet_model_path = 'models\Ghibli-normal-classifier\Mobilenet_ghibli_normal.h5'
     
     # Load the model (assuming you have a function to do this)
+    from tensorflow.keras.models import load_model
     try:
         mobilenet_model = load_model(mobilenet_model_path)
         logging.info(f"Classifier model loaded from: {mobilenet_model_path}")
@@ -0,0 +1,144 @@
+import os, time, queue, logging, threading
+from concurrent.futures import Future
+import numpy as np
+
+import result_cache
+
+# --- Configuration for the batched classifier service ---
+# Concurrent classify() calls are queued and run through the model as one micro-batch:
+# the first request waits at most CLASSIFIER_MAX_WAIT_MS for others to join it.
+CLASSIFIER_MAX_BATCH = int(os.environ.get("CLASSIFIER_MAX_BATCH", 16))
+CLASSIFIER_MAX_WAIT_MS = float(os.environ.get("CLASSIFIER_MAX_WAIT_MS", 5))
+CLASSIFIER_THRESHOLD = 0.5  # Scores above this are "normal", below are "ghibli"
+CLASSIFIER_INPUT_SHAPE = (224, 224, 3)
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def keras_predict_batch(model):
+    """
+    Wraps a Keras model as a compiled batch function. Unlike model.predict, calling a
+    tf.function has no per-call dataset, callback or graph setup; the input signature
+    keeps one trace for every batch size.
+
+    Returns:
+        callable: float32 array [N, 224, 224, 3] -> array of N scores.
+    """
+    import tensorflow as tf
+
+    forward = tf.function(
+        lambda batch: model(batch, training=False),
+        input_signature=[tf.TensorSpec((None,) + CLASSIFIER_INPUT_SHAPE, tf.float32)],
+    )
+    return lambda batch: forward(batch).numpy().reshape(-1)
+
+
+class ClassifierService:
+    """
+    Micro-batching front end for the Ghibli/normal classifier.
+
+    A single daemon thread drains the request queue: it takes the first pending request,
+    gathers whatever else arrives within max_wait_ms (up to max_batch), runs one forward
+    pass and resolves every request's Future. Verdicts are cached in result_cache's
+    "verdict" level under the image content hash plus the classifier's identity, so a
+    known image never reaches the model, and a different or retrained model never
+    reuses another model's verdicts.
+    """
+
+    def __init__(self, predict_batch, model_id, max_batch=CLASSIFIER_MAX_BATCH, max_wait_ms=CLASSIFIER_MAX_WAIT_MS):
+        """
+        Args:
+            predict_batch (callable): float32 array [N, 224, 224, 3] -> N scores, e.g.
+                                      keras_predict_batch(model).
+            model_id (str): Identity of the model (see tflite_classifier.classifier_identity).
+            max_batch (int): Largest batch run in one forward pass.
+            max_wait_ms (float): How long the first request waits for others to batch with.
+        """
+        self.predict_batch = predict_batch
+        self.model_id = model_id
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="classifier-batcher", daemon=True)
+        self._thread.start()
+
+    def verdict_key(self, image_hash):
+        """Result-cache key of this model's verdict on an image."""
+        return f"{self.model_id}|{image_hash}"
+
+    def lookup(self, image_hash):
+        """Returns this model's cached verdict for an image hash, or None if it was never classified."""
+        return result_cache.get("verdict", self.verdict_key(image_hash)) if image_hash else None
+
+    def submit(self, input_array, image_hash=None):
+        """
+        Queues one preprocessed image (see check_conv_ghibli.classifier_input).
+
+        Returns:
+            concurrent.futures.Future: Resolves to True for "normal", False for "ghibli".
+        """
+        future = Future()
+        cached = self.lookup(image_hash)
+        if cached is not None:
+            future.set_result(cached)
+        else:
+            self._queue.put((input_array, image_hash, future))
+        return future
+
+    def classify(self, input_array, image_hash=None):
+        """Blocking submit(): returns True for "normal", False for "ghibli"."""
+        return self.submit(input_array, image_hash).result()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        try:
+            start = time.perf_counter()
+            scores = self.predict_batch(np.stack([item[0] for item in batch]).astype(np.float32, copy=False))
+            logging.info(f"Classified batch of {len(batch)} in {(time.perf_counter() - start) * 1000:.1f} ms")
+        except Exception as e:
+            logging.error(f"Error during batched image classification: {e}")
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+
+        for (_, image_hash, future), score in zip(batch, scores):
+            verdict = bool(score > CLASSIFIER_THRESHOLD)
+            if image_hash:
+                result_cache.put("verdict", self.verdict_key(image_hash), verdict)
+            future.set_result(verdict)
+
+
+def get_classifier_service(model):
+    """
+    Returns the process-wide classifier service, creating it for model on first call.
+
+    Args:
+        model: The loaded classifier (Keras model or tflite_classifier.TFLiteClassifier),
+               with a model_id attribute identifying it.
+
+    Returns:
+        ClassifierService: The shared service, or None if model is None.
+    """
+    global _service
+    if model is None:
+        return None
+    with _service_lock:
+        if _service is None:
+            # TFLite models bring their own batch function; Keras models get a compiled one
+            predict_batch = getattr(model, "predict_batch", None) or keras_predict_batch(model)
+            _service = ClassifierService(predict_batch, model.model_id)
+        return _service
@@ -0,0 +1,59 @@
+import numpy as np
+
+from background_keying import (key_background, border_pixels, KEY_TOLERANCE, FEATHER_RADIUS,
+                               MIN_FOREGROUND_RATIO, MAX_FOREGROUND_RATIO)
+
+# --- Configuration for the cut-out check ---
+# Images that are already cut out (a PNG with a transparent background) or that sit on a
+# plain background (what the Stability prompt asks for) don't need a neural segmentor.
+# Only the image border is inspected before deciding, so the check is cheap for
+# ordinary photos. Uploads are only keyed on a near-white background (product shots,
+# scans, clip art): a photo against a plain colored wall must still be classified and
+# segmented, while generated images are keyed on any plain color.
+CUTOUT_CONFIG = {"engine": "cutout", "version": 3, "tolerance": KEY_TOLERANCE,
+                 "feather": FEATHER_RADIUS}  # Identifies cut-out results in the caches
+TRANSPARENT_BORDER_RATIO = 0.9  # Share of border pixels that must be transparent
+WHITE_TOLERANCE = 24  # With background="white", every channel of the border median must be >= 255 - this
+
+
+def transparent_cutout(alpha):
+    """
+    Returns the image's own alpha channel if it is already a cut-out, i.e. its border is
+    transparent and something opaque is left inside; None otherwise.
+    """
+    if alpha is None:
+        return None
+    if (border_pixels(alpha) == 0).mean() < TRANSPARENT_BORDER_RATIO:
+        return None
+    return alpha if MIN_FOREGROUND_RATIO <= (alpha > 0).mean() <= MAX_FOREGROUND_RATIO else None
+
+
+def near_white_border(im_bgr):
+    """True if the median color of the image border is near white."""
+    return bool(np.median(border_pixels(im_bgr), axis=0).min() >= 255 - WHITE_TOLERANCE)
+
+
+def find_cutout(im_bgr, alpha=None, background="any"):
+    """
+    Checks whether an image can skip neural segmentation.
+
+    Args:
+        im_bgr (numpy.ndarray): The image in BGR format.
+        alpha (numpy.ndarray): Its uint8 alpha channel, or None if it has none.
+        background (str): "white" keys only near-white backgrounds (uploads); "any" keys
+                          any plain background color (generated images).
+
+    Returns:
+        tuple: (alpha, method) where alpha is the uint8 alpha to apply and method is
+               "alpha" (the image's own) or "keyed" (plain background keyed out);
+               (None, None) if neither applies and the image must be segmented.
+    """
+    alpha_mask = transparent_cutout(alpha)
+    if alpha_mask is not None:
+        return alpha_mask, "alpha"
+    if background == "white" and not near_white_border(im_bgr):
+        return None, None
+    keyed = key_background(im_bgr)
+    if keyed.ok:
+        return keyed.alpha, "keyed"
+    return None, None
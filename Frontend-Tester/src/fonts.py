@@ -1,4 +1,7 @@
-import os, logging, requests
+import os, time, logging, requests, threading
+from functools import lru_cache
+
+from PIL import ImageFont
 
 FONTS_DIR = "./fonts"
 
@@ -18,6 +21,16 @@ google_fonts = {
     "Anton": "https://github.com/google/fonts/raw/main/ofl/anton/Anton-Regular.ttf"
 }
 
+# Resolved font paths, so the hot path skips the os.path.exists check after the first call
+_font_paths = {}
+_font_paths_lock = threading.Lock()
+
+# Parsed fonts per (font_name, size); only successful loads are kept
+FONT_RETRY_SECONDS = 60  # A font that fell back to the default is not retried sooner
+_fonts = {}
+_fallbacks = {}  # font_name -> time.monotonic() of the last failed load
+_font_caches = []  # lru_cache functions registered with font_cache
+
 # Function to download fonts if missing
 def get_font(font_name, log_filename):
     # Configure logging to append logs to the latest file
@@ -30,6 +43,10 @@ def get_font(font_name, log_filename):
         )
         
     """Checks if a font is available; if not, downloads it."""
+    font_path = _font_paths.get(font_name)
+    if font_path is not None:
+        return font_path
+
     if font_name not in font_files:
         logging.warning(f"Font '{font_name}' is not recognized. Using default font.")
         return None
@@ -54,4 +71,71 @@ def get_font(font_name, log_filename):
             logging.error(f"No download URL found for {font_name}. Please add the font manually.")
             return None
 
-    return font_path
\ No newline at end of file
+    with _font_paths_lock:
+        _font_paths[font_name] = font_path
+    return font_path
+
+
+def font_cache(cached_function):
+    """
+    Registers an lru_cache-wrapped function whose results depend on loaded fonts (e.g.
+    measured widths), so it is cleared when a font that had fallen back loads after all.
+    Use as a decorator above @lru_cache.
+    """
+    _font_caches.append(cached_function)
+    return cached_function
+
+
+def load_font(font_name, size):
+    """
+    Returns the shared FreeType font for a bundled font at a given size.
+
+    Each (font, size) pair is parsed from its TTF once per process. Unknown or missing
+    fonts fall back to Pillow's default font; that fallback is not cached, and loading is
+    retried after FONT_RETRY_SECONDS, so a transient download error does not stick until
+    restart. When a font loads after falling back, every font_cache is cleared.
+
+    Args:
+        font_name (str): One of the keys of font_files, e.g. "Bangers".
+        size (int): Font size in points.
+
+    Returns:
+        PIL.ImageFont.FreeTypeFont: The loaded font.
+    """
+    font = _fonts.get((font_name, size))
+    if font is not None:
+        return font
+    failed_at = _fallbacks.get(font_name)
+    if failed_at is not None and time.monotonic() - failed_at < FONT_RETRY_SECONDS:
+        return ImageFont.load_default()
+
+    font_path = get_font(font_name, None)
+    try:
+        if font_path:
+            font = ImageFont.truetype(font_path, size)
+    except Exception as e:
+        logging.warning(f"Using default font - couldn't load {font_path}: {e}")
+    if font is None:
+        _fallbacks[font_name] = time.monotonic()
+        return ImageFont.load_default()
+
+    font = _fonts.setdefault((font_name, size), font)
+    if _fallbacks.pop(font_name, None) is not None:
+        logging.info(f"Font '{font_name}' loaded after falling back; clearing cached text metrics")
+        for cached_function in _font_caches:
+            cached_function.cache_clear()
+    return font
+
+
+@font_cache
+@lru_cache(maxsize=4096)
+def text_length(text, font_name, size):
+    """Memoized advance width of text in the given font and size (see ImageDraw.textlength)."""
+    return load_font(font_name, size).getlength(text)
+
+
+def preload_fonts(sizes):
+    """Loads every bundled font at every size in use, e.g. at application startup."""
+    for font_name in font_files:
+        for size in sizes:
+            load_font(font_name, size)
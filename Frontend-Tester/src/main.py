@@ -1,18 +1,32 @@
 # main.py
 import os, atexit, logging
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from tensorflow.keras.models import load_model
 
 # Import necessary functions, including the one for text-to-image generation
+import seg_cache, result_cache
 from to_ghibli import generate_and_save_ghibli_image
-from segmentor_model import segmentor
+from seg_workers import segment, segment_array
+from segmentation_engine import route, route_depends_on_verdict
+from segmentor_model import save_cutout, generate_image_hash, segmentation_config, cutout_config
+from cutout import CUTOUT_CONFIG, find_cutout
 from sticker_generator import conv_to_sticker
-from check_conv_ghibli import is_normal
+from preprocess import prepare
+from classifier_service import get_classifier_service
+from tflite_classifier import load_tflite_classifier, classifier_identity, KERAS_CLASSIFIER_PATH, TFLITE_CLASSIFIER_PATH
 
 UPLOAD_DIR = "uploads"
 OUTPUT_DIR = "stickers"
 FONTS_DIR = "fonts"
 LOG_DIR = "logs"
+# Keep a copy of every upload in UPLOAD_DIR. Written in the background; the pipeline
+# itself works from the in-memory upload buffer.
+PERSIST_UPLOADS = os.environ.get("PERSIST_UPLOADS", "1") == "1"
+
+# "auto" serves the int8 TFLite classifier when it has been exported, else the Keras model
+CLASSIFIER_BACKEND = os.environ.get("CLASSIFIER_BACKEND", "auto")
+
+_persist_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="upload-writer")
 
 _exit_logged = False
 
@@ -45,53 +59,133 @@ def log_exit():
         logging.info("=== AI Sticker Studio closed ===")
         _exit_logged = True
 
-# Load classifier model (remains the same)
+# Load classifier model
 def load_classifier_model():
+    """
+    Loads the Ghibli/normal classifier. The TFLite backend only needs the TFLite
+    interpreter; TensorFlow is imported only when the Keras model is used.
+    """
+    classifier_path = KERAS_CLASSIFIER_PATH
     try:
+        if CLASSIFIER_BACKEND in ("auto", "tflite"):
+            model = load_tflite_classifier()
+            if model is not None:
+                logging.info(f"TFLite classifier loaded from: {TFLITE_CLASSIFIER_PATH}")
+                return model
+            if CLASSIFIER_BACKEND == "tflite":
+                logging.warning(f"TFLite classifier not found at: {TFLITE_CLASSIFIER_PATH}. Run tflite_classifier.py to export it.")
+
         # Update the path if your model is located elsewhere
-        classifier_path = 'models/Ghibli-normal-classifier/Mobilenet_ghibli_normal.h5'
+        from tensorflow.keras.models import load_model
         model = load_model(classifier_path)
+        model.model_id = classifier_identity(classifier_path)  # Keys its cached verdicts
         logging.info(f"Classifier model loaded from: {classifier_path}")
         return model
-    except FileNotFoundError:
+    except (FileNotFoundError, OSError):
         logging.warning(f"Classifier model not found at: {classifier_path}. 'Normal' prediction based theming will be skipped.")
         return None
     except Exception as e:
         logging.error(f"Error loading classifier model: {e}")
         return None
 
+def segmentation_key(upload_hash, engine):
+    """seg_cache key of an upload's segmentation by one engine, with the default settings."""
+    return seg_cache.make_cache_key(upload_hash, segmentation_config(engine))
+
+def segment_upload(image, upload_hash, classifier_service):
+    """
+    Decides, cheapest first, how an upload gets segmented, and does it:
+
+    1. A cached segmentation or cut-out of this upload is returned as is.
+    2. An image that is already a cut-out (transparent PNG) or sits on a near-white
+       background (keyed out by background_keying) skips both the classifier and the
+       segmentor. Other plain backgrounds, like a photo against a wall, are not keyed.
+    3. The classifier runs only if its verdict is unknown and can change the route.
+    4. The routed engine segments the image.
+
+    Returns:
+        str: Path to the segmented WebP, or None on failure.
+    """
+    # 1. Cached results
+    cutout_key = seg_cache.make_cache_key(upload_hash, cutout_config(CUTOUT_CONFIG))
+    seg_img_path = seg_cache.lookup(cutout_key)
+    if seg_img_path:
+        return seg_img_path
+    verdict = classifier_service.lookup(upload_hash) if classifier_service else None
+    for candidate in ((verdict,) if verdict is not None else (True, False)):
+        seg_img_path = seg_cache.lookup(segmentation_key(upload_hash, route(candidate)))
+        if seg_img_path:
+            return seg_img_path
+
+    # 2. Cut-outs need no model. This is a new upload, so the full decode is needed anyway.
+    mask, method = find_cutout(image.bgr, image.alpha, background="white")
+    if mask is not None:
+        logging.info(f"Upload is already a cut-out ({method}); skipping classification and segmentation.")
+        return save_cutout(image.bgr, mask, upload_hash, CUTOUT_CONFIG)
+
+    # 3. Classify the image (batched with other sessions, verdict cached) only if it matters
+    if verdict is None and classifier_service and route_depends_on_verdict():
+        try:
+            verdict = classifier_service.classify(image.classifier_input, upload_hash)
+        except Exception as e:
+            logging.error(f"Error during image classification: {e}")
+    is_image_normal = verdict if verdict is not None else True
+
+    # 4. Segment with the cheapest adequate engine for the verdict
+    engine = route(is_image_normal)
+    logging.info(f"Image classified as {'NORMAL' if is_image_normal is not False else 'GHIBLI'}. Using '{engine.name}' engine.")
+    return segment_array(image.bgr, upload_hash, engine=engine.name)
+
+def persist_upload(upload_bytes, file_path):
+    """Writes the original upload to disk in the background (if PERSIST_UPLOADS is set)."""
+    if not PERSIST_UPLOADS or os.path.exists(file_path):
+        return None
+
+    def _write():
+        tmp_path = f"{file_path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(upload_bytes)
+        os.replace(tmp_path, file_path)
+        logging.info(f"Uploaded file saved: {file_path}")
+
+    return _persist_executor.submit(_write)
+
 # --- New function to process sticker from an uploaded image ---
-def process_sticker_from_image(uploaded_file, text_input, color, selected_font, font_files, classifier, log_filename):
+def process_sticker_from_image(uploaded_file, text_input, color, selected_font, font_files, classifier, log_filename, animation=None):
     """
     Processes an uploaded image to generate a sticker.
-    Uses a classifier to decide whether to use standard or fine-tuned YOLO model for segmentation.
+    Uses the classifier verdict to route segmentation to the cheapest adequate engine
+    (the ghibli-tuned YOLO for ghibli images).
+    Every stage is cached separately (see result_cache), so resubmitting the same photo
+    with a new caption or color skips classification and segmentation; see
+    segment_upload for when the classifier and the segmentor are skipped altogether.
+    animation selects an animated sticker effect ("pop" or "wobble"); None renders a static one.
     """
     try:
-        # Save uploaded image
-        file_path = os.path.join(UPLOAD_DIR, f"{datetime.now().strftime('%Y%m%d%H%M%S')}_{uploaded_file.name}")
-        with open(file_path, "wb") as f:
-            f.write(uploaded_file.getbuffer())
-        logging.info(f"Uploaded file saved: {file_path}")
+        # Level 1: the upload is identified by its content hash, computed from memory
+        upload_bytes = uploaded_file.getbuffer()  # memoryview of the upload, no copy
+        upload_hash = result_cache.hash_bytes(upload_bytes)
+        file_path = os.path.join(UPLOAD_DIR, f"{upload_hash}{os.path.splitext(uploaded_file.name)[1].lower()}")
+        persist_upload(upload_bytes, file_path)
 
         font_filename = font_files[selected_font]
 
-        # Classify the image using the provided classifier
-        is_image_normal = is_normal(file_path, classifier, log_filename) if classifier else True
+        # The upload is read in place (no copy); its pixels are decoded lazily, only if a stage
+        # below misses its cache, and shared by the cut-out check, the classifier and the segmentor
+        image = prepare(uploaded_file)
+        if image is None:
+            logging.error(f"Could not decode uploaded image {uploaded_file.name}")
+            return None
 
-        # Decide which YOLO model to use for segmentation
-        if is_image_normal:
-            logging.info("Image classified as NORMAL. Using standard YOLO model.")
-            seg_img_path = segmentor(file_path)
-        else:
-            logging.info("Image classified as GHIBLI. Using fine-tuned YOLO model.")
-            seg_img_path = segmentor(file_path)
+        # Cost-aware gating: cached results first, then cheap checks, then the models
+        seg_img_path = segment_upload(image, upload_hash, get_classifier_service(classifier))
 
-        if not os.path.exists(seg_img_path):
+        if not seg_img_path or not os.path.exists(seg_img_path):
             logging.error("Image segmentation failed.")
             return None
 
         # Convert the segmented image to a sticker by adding text
-        output_path = conv_to_sticker(seg_img_path, text_input, color, font_filename, log_filename)
+        output_path = conv_to_sticker(seg_img_path, text_input, color, font_filename, log_filename, animation)
 
         if os.path.exists(output_path):
             logging.info(f"Sticker successfully generated from uploaded image: {output_path}")
@@ -105,7 +199,7 @@ def process_sticker_from_image(uploaded_file, text_input, color, selected_font,
         return None
 
 # --- New function to process sticker from text input (generates image first) ---
-def process_sticker_from_text(text_for_image, text_input, color, selected_font, font_files, log_filename):
+def process_sticker_from_text(text_for_image, text_input, color, selected_font, font_files, log_filename, animation=None):
     """
     Generates an image from text input, then processes it to create a sticker.
     Assumes the generated image is already in a desired style (e.g., Ghibli).
@@ -127,14 +221,23 @@ def process_sticker_from_text(text_for_image, text_input, color, selected_font,
         themed_img_path = generated_img_path
         logging.info("Using generated image directly for segmentation.")
 
-        # Segment the generated image
-        seg_img_path = segmentor(themed_img_path, log_filename, model_name='ghibli')
-        if not os.path.exists(seg_img_path):
+        # Generated images are prompted onto a plain white background: key it out in a few
+        # milliseconds. Only if the key fails its quality check are they segmented, as
+        # ghibli-style images (by construction, so the classifier is never run on them).
+        image = prepare(themed_img_path)
+        mask, method = find_cutout(image.bgr, image.alpha, background="any") if image else (None, None)
+        if mask is not None:
+            logging.info(f"Generated image is already a cut-out ({method}); skipping neural segmentation.")
+            seg_img_path = save_cutout(image.bgr, mask, generate_image_hash(themed_img_path), CUTOUT_CONFIG)
+        else:
+            engine = route(is_image_normal=False)
+            seg_img_path = segment(themed_img_path, engine=engine.name)
+        if not seg_img_path or not os.path.exists(seg_img_path):
             logging.error("Image segmentation failed after text-to-image generation.")
             return None
 
         # Convert the segmented image to a sticker by adding text
-        output_path = conv_to_sticker(seg_img_path, text_input, color, font_filename, log_filename)
+        output_path = conv_to_sticker(seg_img_path, text_input, color, font_filename, log_filename, animation)
 
         if os.path.exists(output_path):
             logging.info(f"Sticker successfully generated from text-based image: {output_path}")
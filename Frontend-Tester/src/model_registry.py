@@ -0,0 +1,53 @@
+import logging, threading
+
+# --- Process-wide model registry ---
+# Models are registered by name with a loader function and only built the first time
+# someone asks for them. Every caller in the process then shares the same instance.
+_loaders = {}
+_models = {}
+_load_locks = {}
+_registry_lock = threading.Lock()
+
+
+def register_model(name, loader):
+    """
+    Registers a loader for a model without building it.
+
+    Args:
+        name (str): Registry name, e.g. "detectron2".
+        loader (callable): Zero-argument function that builds and returns the model.
+    """
+    with _registry_lock:
+        _loaders[name] = loader
+        _load_locks.setdefault(name, threading.Lock())
+
+
+def get_model(name):
+    """
+    Returns the shared model instance, loading it on first use.
+
+    Concurrent first callers block on a per-model lock, so a model is only ever built once.
+
+    Args:
+        name (str): Registry name of a previously registered model.
+
+    Returns:
+        object: The loaded model.
+    """
+    model = _models.get(name)
+    if model is not None:
+        return model
+
+    with _registry_lock:
+        if name not in _loaders:
+            raise KeyError(f"No model registered under '{name}'")
+        load_lock = _load_locks[name]
+
+    with load_lock:
+        model = _models.get(name)
+        if model is None:
+            logging.info(f"Loading model '{name}'...")
+            model = _loaders[name]()
+            _models[name] = model
+            logging.info(f"Model '{name}' loaded.")
+    return model
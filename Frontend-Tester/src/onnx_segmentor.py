@@ -0,0 +1,154 @@
+import os, logging
+import cv2
+import numpy as np
+
+from model_registry import register_model, get_model
+
+# --- Configuration for the ONNX Runtime segmentation backend ---
+# The YOLOv8-seg checkpoint is exported to ONNX once, quantized to int8 with dynamic
+# quantization, and then served by ONNX Runtime on CPU.
+YOLO_WEIGHTS = "models/yolov8n-seg.pt"
+ONNX_MODEL_PATH = "models/yolov8n-seg.onnx"
+ONNX_INT8_MODEL_PATH = "models/yolov8n-seg.int8.onnx"
+ONNX_INPUT_SIZE = 640
+ONNX_NUM_THREADS = int(os.environ.get("ONNX_NUM_THREADS", os.cpu_count() or 1))
+SCORE_THRESH = 0.5
+NMS_IOU_THRESH = 0.45
+MASK_THRESH = 0.5
+LETTERBOX_COLOR = (114, 114, 114)
+
+# Cache key config for segmentations produced by this backend
+MODEL_CONFIG = {
+    "backend": "onnx",
+    "weights": ONNX_INT8_MODEL_PATH,
+    "score_thresh": SCORE_THRESH,
+    "input_size": ONNX_INPUT_SIZE,
+}
+
+
+def export_onnx(weights=YOLO_WEIGHTS, output_path=ONNX_INT8_MODEL_PATH, imgsz=ONNX_INPUT_SIZE):
+    """
+    Exports a YOLOv8-seg checkpoint to ONNX and applies int8 dynamic quantization.
+
+    Args:
+        weights (str): Path to the YOLOv8-seg .pt checkpoint.
+        output_path (str): Where the quantized ONNX model is written.
+        imgsz (int): Static square input size baked into the exported graph.
+
+    Returns:
+        str: Path to the quantized ONNX model.
+    """
+    from ultralytics import YOLO
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    logging.info(f"Exporting {weights} to ONNX (imgsz={imgsz})...")
+    fp32_path = YOLO(weights).export(format="onnx", imgsz=imgsz, dynamic=False, simplify=True)
+
+    logging.info(f"Quantizing {fp32_path} to int8...")
+    quantize_dynamic(fp32_path, output_path, weight_type=QuantType.QUInt8)
+    logging.info(f"Quantized ONNX model saved to: {output_path}")
+    return output_path
+
+
+def load_onnx_session(model_path=ONNX_INT8_MODEL_PATH, num_threads=ONNX_NUM_THREADS):
+    """
+    Creates the ONNX Runtime session, exporting the model first if it does not exist yet.
+
+    Args:
+        model_path (str): Path to the (quantized) ONNX model.
+        num_threads (int): Intra-op thread count for the CPU execution provider.
+
+    Returns:
+        onnxruntime.InferenceSession: The ready-to-run session.
+    """
+    import onnxruntime as ort
+
+    if not os.path.exists(model_path):
+        export_onnx(output_path=model_path)
+
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = num_threads
+    options.inter_op_num_threads = 1
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+
+
+register_model("yolo_onnx", load_onnx_session)
+
+
+def letterbox(im_bgr, size=ONNX_INPUT_SIZE):
+    """
+    Resizes an image into a size x size canvas keeping the aspect ratio (YOLO letterbox).
+
+    Returns:
+        tuple: (canvas, scale, (pad_x, pad_y)) needed to map predictions back.
+    """
+    height, width = im_bgr.shape[:2]
+    scale = min(size / height, size / width)
+    new_w, new_h = round(width * scale), round(height * scale)
+    resized = cv2.resize(im_bgr, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    pad_x, pad_y = (size - new_w) // 2, (size - new_h) // 2
+    canvas = cv2.copyMakeBorder(resized, pad_y, size - new_h - pad_y, pad_x, size - new_w - pad_x,
+                                cv2.BORDER_CONSTANT, value=LETTERBOX_COLOR)
+    return canvas, scale, (pad_x, pad_y)
+
+
+def predict_mask(im_bgr, session=None):
+    """
+    Runs YOLOv8-seg through ONNX Runtime and returns the composite foreground mask.
+
+    Args:
+        im_bgr (numpy.ndarray): The input image in BGR format.
+        session (onnxruntime.InferenceSession): Optional session, defaults to the shared one.
+
+    Returns:
+        numpy.ndarray: Boolean [height, width] mask, True wherever any object was detected.
+    """
+    session = session or get_model("yolo_onnx")
+    height, width = im_bgr.shape[:2]
+
+    canvas, scale, (pad_x, pad_y) = letterbox(im_bgr)
+    blob = cv2.dnn.blobFromImage(canvas, scalefactor=1 / 255.0, swapRB=True)  # 1x3xSxS float32 RGB
+
+    input_name = session.get_inputs()[0].name
+    preds, protos = session.run(None, {input_name: blob})
+    # preds: [1, 4 + num_classes + num_coeffs, num_anchors], protos: [1, num_coeffs, mask_h, mask_w]
+    num_coeffs, mask_h, mask_w = protos.shape[1:]
+    preds = preds[0].T
+    boxes_xywh = preds[:, :4]
+    class_scores = preds[:, 4:-num_coeffs]
+    coeffs = preds[:, -num_coeffs:]
+
+    scores = class_scores.max(axis=1)
+    keep = scores > SCORE_THRESH
+    if not keep.any():
+        return np.zeros((height, width), dtype=bool)
+    boxes_xywh, scores, coeffs = boxes_xywh[keep], scores[keep], coeffs[keep]
+
+    # Centre-xywh -> top-left-xywh for OpenCV's NMS
+    boxes_tl = boxes_xywh.copy()
+    boxes_tl[:, :2] -= boxes_tl[:, 2:] / 2
+    indices = cv2.dnn.NMSBoxes(boxes_tl.tolist(), scores.tolist(), SCORE_THRESH, NMS_IOU_THRESH)
+    indices = np.asarray(indices, dtype=int).reshape(-1)
+    if indices.size == 0:
+        return np.zeros((height, width), dtype=bool)
+    boxes_tl, coeffs = boxes_tl[indices], coeffs[indices]
+
+    # Instance masks at prototype resolution: sigmoid(coeffs @ protos)
+    logits = coeffs @ protos[0].reshape(num_coeffs, -1)
+    masks = (1.0 / (1.0 + np.exp(-logits))).reshape(-1, mask_h, mask_w)
+
+    # Crop each instance mask to its box (in prototype coordinates) and merge
+    ratio = mask_w / ONNX_INPUT_SIZE
+    composite = np.zeros((mask_h, mask_w), dtype=np.float32)
+    for mask, (x, y, w, h) in zip(masks, boxes_tl * ratio):
+        x0, y0 = max(int(x), 0), max(int(y), 0)
+        x1, y1 = min(int(np.ceil(x + w)), mask_w), min(int(np.ceil(y + h)), mask_h)
+        np.maximum(composite[y0:y1, x0:x1], mask[y0:y1, x0:x1], out=composite[y0:y1, x0:x1])
+
+    # Single upsample of the merged mask, then undo the letterbox
+    composite = cv2.resize(composite, (ONNX_INPUT_SIZE, ONNX_INPUT_SIZE), interpolation=cv2.INTER_LINEAR)
+    new_w, new_h = round(width * scale), round(height * scale)
+    composite = composite[pad_y:pad_y + new_h, pad_x:pad_x + new_w]
+    composite = cv2.resize(composite, (width, height), interpolation=cv2.INTER_LINEAR)
+    return composite > MASK_THRESH
@@ -0,0 +1,122 @@
+import io
+import cv2
+import numpy as np
+from PIL import Image, ImageOps
+
+# --- Shared decode-and-resize stage ---
+# An upload is decoded once and every consumer reads from that decode: the segmentor
+# gets the BGR array, the classifier a float32 224x224 tensor and the cut-out check the
+# alpha channel. Only the BGR array and the alpha channel are kept. In the app every new
+# upload is segmented, so it always takes the full decode; path-based callers that only
+# classify (check_conv_ghibli.is_normal) get JPEGs decoded in draft mode, letting libjpeg
+# downscale in the DCT domain (up to 8x fewer pixels decoded).
+CLASSIFIER_SIZE = (224, 224)
+
+
+def classifier_tensor(im_rgb, bgr=False):
+    """
+    Resizes an RGB array to the classifier input, as load_img(target_size=(224, 224)) does
+    (nearest neighbour), and scales it to [0, 1] in float32 without float64 temporaries.
+
+    Args:
+        im_rgb (numpy.ndarray): The image, in RGB order unless bgr is set.
+        bgr (bool): The image is in BGR order; channels are swapped after the resize.
+
+    Returns:
+        numpy.ndarray: float32 array of shape (224, 224, 3).
+    """
+    small = cv2.resize(im_rgb, CLASSIFIER_SIZE, interpolation=cv2.INTER_NEAREST)
+    if bgr:
+        small = cv2.cvtColor(small, cv2.COLOR_BGR2RGB)
+    return np.multiply(small, np.float32(1 / 255), dtype=np.float32)
+
+
+def _oriented(image):
+    """Applies the EXIF orientation, as cv2.imread does, so every consumer sees the same pixels."""
+    return ImageOps.exif_transpose(image) or image
+
+
+class PreparedImage:
+    """
+    One upload, decoded lazily and at most once at full resolution.
+
+    Args:
+        data (bytes | memoryview | str | file-like): The encoded image, a path to it, or a
+            seekable binary file object (e.g. a Streamlit UploadedFile), read in place.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self._alpha = None
+        self._bgr = None
+        self._tensor = None
+        self.decoded = False
+        with self._open() as image:
+            self.format = image.format
+            self.size = image.size
+
+    def _open(self):
+        """Opens the encoded image without decoding its pixels yet (and without copying it)."""
+        if isinstance(self.data, str):
+            return Image.open(self.data)
+        if hasattr(self.data, "read"):
+            self.data.seek(0)
+            return Image.open(self.data)
+        return Image.open(io.BytesIO(self.data))
+
+    def decode(self):
+        """
+        Full-resolution decode straight to BGR; the alpha channel, if any, is kept as its
+        own compact array and the decoded RGB(A) pixels are released.
+        """
+        if self.decoded:
+            return
+        with self._open() as image:
+            image = _oriented(image)
+            has_alpha = "A" in image.getbands() or "transparency" in image.info
+            pixels = np.asarray(image.convert("RGBA" if has_alpha else "RGB"))
+        self._bgr = cv2.cvtColor(pixels, cv2.COLOR_RGBA2BGR if has_alpha else cv2.COLOR_RGB2BGR)
+        self._alpha = pixels[..., 3].copy() if has_alpha else None
+        self.decoded = True
+
+    @property
+    def bgr(self):
+        """Full-resolution BGR array for the segmentor."""
+        self.decode()
+        return self._bgr
+
+    @property
+    def alpha(self):
+        """The alpha channel as a uint8 array, or None if the image is opaque."""
+        self.decode()
+        return self._alpha
+
+    @property
+    def classifier_input(self):
+        """
+        float32 (224, 224, 3) classifier tensor. Derived from the full decode if one has
+        already happened; otherwise decoded on its own in JPEG draft mode.
+        """
+        if self._tensor is None:
+            if self.decoded:
+                self._tensor = classifier_tensor(self._bgr, bgr=True)
+            else:
+                with self._open() as image:
+                    # Only reduces JPEGs, and never below the requested size
+                    image.draft("RGB", CLASSIFIER_SIZE)
+                    self._tensor = classifier_tensor(np.asarray(_oriented(image).convert("RGB")))
+        return self._tensor
+
+
+def prepare(data):
+    """
+    Returns a PreparedImage, or None if data is not a readable image.
+
+    Args:
+        data (bytes | memoryview | str | file-like): The encoded image, a path to it, or a
+            seekable binary file object.
+    """
+    try:
+        return PreparedImage(data)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
@@ -0,0 +1,157 @@
+import os, json, queue, atexit, hashlib, logging, threading
+from collections import OrderedDict
+
+# --- Configuration for the end-to-end result cache ---
+# Each pipeline stage is cached under its own key, so a request only recomputes the
+# stages whose inputs changed. Changing just the caption or color of an upload reuses
+# its verdict and segmentation and only re-renders the sticker:
+#
+#   upload        upload content hash  -> content-addressed file in uploads/
+#   verdict       classifier id + hash -> classifier verdict
+#   segmentation  seg_cache key        -> segmented images/<key>.webp (seg_cache.lookup)
+#   seg_hash      segmented image path -> segmented image content hash
+#   caption layer                      -> sticker_generator.render_caption_layer (lru_cache)
+#   sticker       sticker_store key    -> stickers/<key>.webp
+#
+# The verdict and seg_hash levels live here, in memory. Every put is also
+# appended to RESULT_CACHE_FILE, a JSON-lines log, by a background writer thread, so they
+# survive restarts without any file I/O on the request path. The log is replayed on first
+# use and compacted to the live entries once it grows past RESULT_CACHE_COMPACT_FACTOR
+# times their number.
+RESULT_CACHE_FILE = os.path.join("cache", "results.jsonl")
+RESULT_CACHE_MAX_ENTRIES = 10000  # Per level, least-recently-used entries are dropped first
+RESULT_CACHE_COMPACT_FACTOR = 2
+LEVELS = ("verdict", "seg_hash")
+
+_lock = threading.Lock()
+_levels = None  # level -> OrderedDict, replayed from RESULT_CACHE_FILE on first use
+_stats = {level: {"hits": 0, "misses": 0} for level in LEVELS}
+_log_lines = 0  # Records in RESULT_CACHE_FILE, only touched by the writer thread after _load
+_writes = queue.Queue()  # (level, key, value) records waiting to be appended
+_writer = None
+
+
+def hash_bytes(data):
+    """Returns the SHA256 of an in-memory buffer (same digest as generate_image_hash on its file)."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def _load():
+    """Returns the level tables, replaying the log on first use (caller holds _lock)."""
+    global _levels, _log_lines
+    if _levels is None:
+        _levels = {level: OrderedDict() for level in LEVELS}
+        try:
+            with open(RESULT_CACHE_FILE) as f:
+                for line in f:
+                    try:
+                        level, key, value = json.loads(line)
+                    except ValueError:
+                        continue  # A torn last line from an interrupted write
+                    _log_lines += 1
+                    table = _levels.get(level)
+                    if table is None:
+                        continue  # A level that no longer exists
+                    table[key] = value
+                    table.move_to_end(key)
+            for table in _levels.values():
+                while len(table) > RESULT_CACHE_MAX_ENTRIES:
+                    table.popitem(last=False)
+        except OSError:
+            pass
+    return _levels
+
+
+def _enqueue(level, key, value):
+    """Hands one record to the writer thread, starting it on first use (caller holds _lock)."""
+    global _writer
+    if _writer is None:
+        _writer = threading.Thread(target=_write_loop, name="result-cache-writer", daemon=True)
+        _writer.start()
+    _writes.put((level, key, value))
+
+
+def _write_loop():
+    """Appends queued records to the log in batches and compacts it when it grows too long."""
+    global _log_lines
+    while True:
+        records = [_writes.get()]
+        while True:
+            try:
+                records.append(_writes.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            os.makedirs(os.path.dirname(RESULT_CACHE_FILE), exist_ok=True)
+            with open(RESULT_CACHE_FILE, "a") as f:
+                f.writelines(json.dumps(record) + "\n" for record in records)
+            _log_lines += len(records)
+            with _lock:
+                live = sum(len(table) for table in _levels.values())
+            if _log_lines > RESULT_CACHE_COMPACT_FACTOR * max(live, RESULT_CACHE_MAX_ENTRIES):
+                _compact()
+        except OSError as e:
+            logging.warning(f"Could not persist result cache: {e}")
+        finally:
+            for _ in records:
+                _writes.task_done()
+
+
+def _compact():
+    """Rewrites the log with only the live entries (writer thread only, outside _lock)."""
+    global _log_lines
+    with _lock:
+        snapshot = [(level, key, value) for level, table in _levels.items() for key, value in table.items()]
+    tmp_path = f"{RESULT_CACHE_FILE}.tmp"
+    with open(tmp_path, "w") as f:
+        f.writelines(json.dumps(record) + "\n" for record in snapshot)
+    os.replace(tmp_path, RESULT_CACHE_FILE)
+    _log_lines = len(snapshot)
+    logging.info(f"Compacted result cache log to {len(snapshot)} entries")
+
+
+def flush():
+    """Blocks until every queued record has been written to the log."""
+    _writes.join()
+
+
+def get(level, key):
+    """
+    Looks up a cached stage result.
+
+    Args:
+        level (str): One of LEVELS.
+        key (str): The stage's input key.
+
+    Returns:
+        The cached value, or None on a miss.
+    """
+    with _lock:
+        table = _load()[level]
+        if key in table:
+            table.move_to_end(key)
+            _stats[level]["hits"] += 1
+            return table[key]
+        _stats[level]["misses"] += 1
+        return None
+
+
+def put(level, key, value):
+    """Stores a stage result (must be JSON-serialisable) and queues it for the log."""
+    with _lock:
+        table = _load()[level]
+        table[key] = value
+        table.move_to_end(key)
+        while len(table) > RESULT_CACHE_MAX_ENTRIES:
+            table.popitem(last=False)
+        _enqueue(level, key, value)
+
+
+def get_stats():
+    """Returns a copy of the per-level hit/miss counters."""
+    with _lock:
+        return {level: dict(counts) for level, counts in _stats.items()}
+
+
+# Drain the writer queue on a clean interpreter exit so the last results are not lost
+atexit.register(flush)
@@ -0,0 +1,124 @@
+import os, json, hashlib, logging, threading
+
+# --- Configuration for the segmentation cache ---
+# Every entry is the transparent WebP produced by the segmentor, stored under a key
+# derived from the input image content hash plus the model configuration that produced it.
+SEG_CACHE_DIR = "segmented images"
+SEG_CACHE_MAX_BYTES = 512 * 1024 * 1024  # 512 MB on disk before LRU eviction kicks in
+
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+
+def make_cache_key(image_hash, model_config):
+    """
+    Builds the cache key for one segmentation result.
+
+    Args:
+        image_hash (str): SHA256 of the input image content (see generate_image_hash).
+        model_config (dict): Everything that changes the output mask, e.g. the model
+                             weights and the score threshold.
+
+    Returns:
+        str: Hexadecimal SHA256 of the image hash and the canonicalised model config.
+    """
+    config_blob = json.dumps(model_config, sort_keys=True, default=str)
+    return hashlib.sha256(f"{image_hash}|{config_blob}".encode("utf-8")).hexdigest()
+
+
+def cache_path(key, cache_dir=SEG_CACHE_DIR):
+    """Returns the on-disk location of a cache entry."""
+    return os.path.join(cache_dir, f"{key}.webp")
+
+
+def lookup(key, cache_dir=SEG_CACHE_DIR):
+    """
+    Looks up a segmentation result without touching the model.
+
+    Args:
+        key (str): Cache key from make_cache_key.
+        cache_dir (str): Directory holding the cached WebP files.
+
+    Returns:
+        str: Path to the cached transparent WebP on a hit, None on a miss.
+    """
+    path = cache_path(key, cache_dir)
+    with _lock:
+        if os.path.exists(path):
+            # Refresh the access time so the entry becomes most-recently-used
+            try:
+                os.utime(path, None)
+            except OSError:
+                pass
+            _stats["hits"] += 1
+            logging.info(f"Segmentation cache hit: {path}")
+            return path
+        _stats["misses"] += 1
+        logging.info(f"Segmentation cache miss for key {key[:12]}...")
+        return None
+
+
+def store(key, image, cache_dir=SEG_CACHE_DIR, max_bytes=SEG_CACHE_MAX_BYTES):
+    """
+    Saves a segmented RGBA image into the cache and evicts old entries if needed.
+
+    Args:
+        key (str): Cache key from make_cache_key.
+        image (PIL.Image.Image): Transparent RGBA image to store.
+        cache_dir (str): Directory holding the cached WebP files.
+        max_bytes (int): Size bound for the cache directory.
+
+    Returns:
+        str: Path to the stored WebP file.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    path = cache_path(key, cache_dir)
+    # Write to a temporary file first so a concurrent lookup never sees a half-written entry
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    image.save(tmp_path, format="WebP")
+    os.replace(tmp_path, path)
+    evict(cache_dir, max_bytes)
+    return path
+
+
+def evict(cache_dir=SEG_CACHE_DIR, max_bytes=SEG_CACHE_MAX_BYTES):
+    """
+    Removes least-recently-used entries until the cache fits in max_bytes.
+
+    Returns:
+        int: Number of evicted entries.
+    """
+    with _lock:
+        try:
+            entries = []
+            with os.scandir(cache_dir) as it:
+                for entry in it:
+                    if entry.is_file() and entry.name.endswith(".webp"):
+                        st = entry.stat()
+                        entries.append((st.st_mtime, st.st_size, entry.path))
+        except FileNotFoundError:
+            return 0
+
+        total = sum(size for _, size, _ in entries)
+        if total <= max_bytes:
+            return 0
+
+        evicted = 0
+        for _, size, path in sorted(entries):
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                evicted += 1
+            except OSError as e:
+                logging.warning(f"Could not evict cache entry {path}: {e}")
+        _stats["evictions"] += evicted
+        logging.info(f"Segmentation cache evicted {evicted} entries ({total} bytes left)")
+        return evicted
+
+
+def get_stats():
+    """Returns a copy of the hit/miss/eviction counters."""
+    with _lock:
+        return dict(_stats)
@@ -0,0 +1,130 @@
+import os, logging, threading
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+
+# --- Configuration for the segmentation worker pool ---
+# Each worker process loads the predictor once and serves segmentor() jobs from the
+# pool's queue. Workers x threads-per-worker is sized to the number of CPU cores so
+# concurrent Streamlit sessions spread across cores instead of sharing one predictor.
+SEG_WORKERS = int(os.environ.get("SEG_WORKERS", 0))  # 0 runs segmentation in-process
+CPU_COUNT = os.cpu_count() or 1
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def threads_per_worker(num_workers, cpu_count=CPU_COUNT):
+    """Splits the CPU cores evenly between workers (at least one thread each)."""
+    return max(1, cpu_count // max(1, num_workers))
+
+
+def _init_worker(num_threads, engine_name):
+    """Runs once in every worker process: pins torch and ONNX Runtime threads and preloads the model."""
+    # OpenMP reads OMP_NUM_THREADS when torch is first imported, and onnx_segmentor reads
+    # ONNX_NUM_THREADS when segmentation_engine imports it, so both are set before either import
+    os.environ["OMP_NUM_THREADS"] = str(num_threads)
+    os.environ["ONNX_NUM_THREADS"] = str(num_threads)
+    import torch
+    torch.set_num_threads(num_threads)
+    torch.set_num_interop_threads(1)
+
+    from segmentation_engine import get_engine, route
+    engine = get_engine(engine_name) if engine_name else route()
+    engine.load()
+    logging.info(f"Segmentation worker {os.getpid()} ready with {num_threads} threads")
+
+
+def _run_segmentor(image_path, kwargs):
+    import segmentor_model
+    return segmentor_model.segmentor(image_path, **kwargs)
+
+
+def _run_segment_array(im_bgr, image_hash, kwargs):
+    import segmentor_model
+    return segmentor_model.segment_array(im_bgr, image_hash, **kwargs)
+
+
+def get_pool(num_workers=SEG_WORKERS, engine=None):
+    """
+    Returns the shared worker pool, starting it on first call.
+
+    Args:
+        num_workers (int): Number of worker processes.
+        engine (str): Segmentation engine to preload in every worker (routed if None).
+
+    Returns:
+        concurrent.futures.ProcessPoolExecutor: The pool, or None if num_workers is 0.
+    """
+    global _pool
+    if num_workers <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            num_threads = threads_per_worker(num_workers)
+            logging.info(f"Starting {num_workers} segmentation workers x {num_threads} threads")
+            # "spawn" avoids forking a process that may already hold torch thread pools
+            _pool = ProcessPoolExecutor(
+                max_workers=num_workers,
+                mp_context=mp.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(num_threads, engine),
+            )
+            # Workers are spawned on demand; one trivial job each starts them all now,
+            # so the model is loaded before the first real request arrives
+            for _ in range(num_workers):
+                _pool.submit(os.getpid)
+        return _pool
+
+
+def submit(image_path, **kwargs):
+    """
+    Queues a segmentor() job on the worker pool.
+
+    Args:
+        image_path (str): The path to the input image file.
+        **kwargs: Passed through to segmentor_model.segmentor.
+
+    Returns:
+        concurrent.futures.Future: Resolves to the segmented WebP path (or None).
+    """
+    pool = get_pool(engine=kwargs.get("engine"))
+    if pool is None:
+        raise RuntimeError("Segmentation worker pool is disabled (SEG_WORKERS=0)")
+    return pool.submit(_run_segmentor, image_path, kwargs)
+
+
+def segment(image_path, **kwargs):
+    """
+    Segments an image on the worker pool if one is configured, otherwise in-process.
+
+    Returns:
+        str: The path to the saved WebP file if successful, None otherwise.
+    """
+    if SEG_WORKERS > 0:
+        return submit(image_path, **kwargs).result()
+    import segmentor_model
+    return segmentor_model.segmentor(image_path, **kwargs)
+
+
+def segment_array(im_bgr, image_hash, **kwargs):
+    """
+    Segments an already-decoded BGR array, on the worker pool if one is configured
+    (the array is pickled to the worker) or in-process without any copy.
+
+    Returns:
+        str: The path to the saved WebP file if successful, None otherwise.
+    """
+    if SEG_WORKERS > 0:
+        pool = get_pool(engine=kwargs.get("engine"))
+        return pool.submit(_run_segment_array, im_bgr, image_hash, kwargs).result()
+    import segmentor_model
+    return segmentor_model.segment_array(im_bgr, image_hash, **kwargs)
+
+
+def shutdown():
+    """Stops the worker pool, waiting for queued jobs to finish."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True)
+            _pool = None
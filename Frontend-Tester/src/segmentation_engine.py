@@ -0,0 +1,339 @@
+import os, re, glob, logging, threading, configparser
+import numpy as np
+
+import onnx_segmentor
+import background_keying
+from model_registry import register_model, get_model
+
+# --- Configuration for the pre-trained Detectron2 model ---
+# Make sure this config file path is correct relative to where you run the script
+# or provide an absolute path.
+DETECTRON2_CONFIG_FILE = "detectron2/configs/COCO-InstanceSegmentation/mask_rcnn_R_50_FPN_3x.yaml"
+# This weight path is a URL, Detectron2 will download it if not found locally.
+DETECTRON2_WEIGHTS = "detectron2://COCO-InstanceSegmentation/mask_rcnn_R_50_FPN_3x/137849600/model_final_f10217.pkl"
+SCORE_THRESH_TEST = 0.7 # Set a higher threshold for cleaner results
+
+# --- Configuration for the fine-tuned YOLOv8-seg model ---
+# backend-model-development/training.py fine-tunes a single YOLOv8n-seg model on the
+# scraped Ghibli images and saves each run as <base>_trained_count_<NNNN>.pt in the
+# models_directory of its config.ini. Checkpoints are looked up there and in the deployed
+# models/yolo_animated directory; the highest count wins. No model is trained for normal
+# photos, so those are segmented by the generic COCO engines.
+TRAINING_CONFIG_FILE = os.path.join("..", "backend-model-development", "config.ini")
+YOLO_SCORE_THRESH = 0.5
+
+# Forces one engine for every request (e.g. "detectron2"), bypassing the router
+SEGMENTATION_BACKEND = os.environ.get("SEGMENTATION_BACKEND")
+
+
+def load_detectron2_predictor():
+    """
+    Builds the Detectron2 DefaultPredictor. Registered with the model registry so it is
+    only constructed on first use (or by a background warm-up), not at import time.
+    """
+    # Detectron2 imports are deferred so importing this module stays cheap
+    from detectron2.config import get_cfg
+    from detectron2.engine import DefaultPredictor
+
+    cfg = get_cfg()
+    cfg.merge_from_file(DETECTRON2_CONFIG_FILE)
+    cfg.MODEL.ROI_HEADS.SCORE_THRESH_TEST = SCORE_THRESH_TEST
+    cfg.MODEL.DEVICE = "cpu" # !!! IMPORTANT FOR CPU !!!
+    cfg.MODEL.WEIGHTS = DETECTRON2_WEIGHTS
+    return DefaultPredictor(cfg)
+
+
+register_model("detectron2", load_detectron2_predictor)
+
+
+def get_predictor():
+    """Returns the shared Detectron2 predictor, loading it on first call."""
+    return get_model("detectron2")
+
+
+def instances_to_mask(instances, height, width):
+    """
+    Merges Detectron2 instance predictions into one boolean [height, width] mask.
+    """
+    # Check if any instances were detected after filtering by score threshold
+    if len(instances) == 0:
+        return np.zeros((height, width), dtype=bool)
+
+    # Get the predicted masks. These are boolean tensors/arrays [num_instances, height, width]
+    pred_masks = instances.pred_masks.to("cpu").numpy() # Move to CPU and convert to numpy
+
+    # Correct Composite Mask: True wherever *any* segmented object exists
+    return pred_masks.any(axis=0)
+
+
+def training_models_dir(config_file=TRAINING_CONFIG_FILE):
+    """
+    Returns the directory training.py saves its checkpoints to: models_directory from its
+    config.ini, which is relative to the backend-model-development directory.
+    """
+    config = configparser.ConfigParser()
+    config.read(config_file)
+    models_dir = config.get("Paths", "models_directory", fallback="models").strip()
+    return os.path.join(os.path.dirname(config_file), models_dir)
+
+
+YOLO_MODEL_DIRS = [
+    os.environ.get("YOLO_MODEL_DIR") or os.path.join("models", "yolo_animated"),
+    training_models_dir(),
+]
+
+
+def find_trained_yolo(model_dirs=None):
+    """
+    Finds the latest fine-tuned YOLOv8-seg checkpoint.
+
+    Args:
+        model_dirs (list[str]): Directories to search, YOLO_MODEL_DIRS by default.
+
+    Returns:
+        str: Path to the *_trained_count_*.pt file with the highest count, or None.
+    """
+    candidates = [path for model_dir in (model_dirs or YOLO_MODEL_DIRS)
+                  for path in glob.glob(os.path.join(model_dir, "*_trained_count_*.pt"))]
+    if not candidates:
+        return None
+
+    def run_count(path):
+        match = re.search(r"_trained_count_(\d+)\.pt$", path)
+        return int(match.group(1)) if match else -1
+
+    return max(candidates, key=run_count)
+
+
+def _dir_mtime(path):
+    """Modification time of a directory in ns, or None if it does not exist."""
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+class SegmentationEngine:
+    """
+    Common interface of the segmentation backends.
+
+    An engine maps a BGR image to a boolean composite foreground mask. relative_cost is
+    the approximate CPU cost per image used by the router to pick the cheapest engine.
+    """
+    name = None
+    relative_cost = 1.0
+
+    def is_available(self):
+        """Returns True if the engine's weights are present and it can be loaded."""
+        return True
+
+    def load(self):
+        """Loads the underlying model through the model registry."""
+        raise NotImplementedError
+
+    def predict_mask(self, im_bgr):
+        """Returns the boolean [height, width] composite foreground mask."""
+        raise NotImplementedError
+
+    def cache_config(self):
+        """Everything that identifies this engine's results in the segmentation cache."""
+        return {"engine": self.name}
+
+
+class Detectron2Engine(SegmentationEngine):
+    """COCO Mask R-CNN R50-FPN. The most accurate general-purpose engine, and the slowest on CPU."""
+    name = "detectron2"
+    relative_cost = 10.0
+
+    def load(self):
+        return get_predictor()
+
+    def predict_mask(self, im_bgr):
+        outputs = self.load()(im_bgr)
+        return instances_to_mask(outputs["instances"], *im_bgr.shape[:2])
+
+    def cache_config(self):
+        # Same keys as before the engine refactor, so existing cache entries stay valid
+        return {"weights": DETECTRON2_WEIGHTS, "score_thresh": SCORE_THRESH_TEST}
+
+
+class YoloEngine(SegmentationEngine):
+    """The Ghibli-tuned YOLOv8n-seg checkpoint from training.py, run through Ultralytics."""
+    name = "yolo_ghibli"
+    relative_cost = 2.0
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._weights = None
+        self._weights_stamp = None  # Directory mtimes the cached weights were resolved at
+        self._predict_locks = {}  # Registry name -> lock serialising predict() on that model
+
+    @property
+    def weights(self):
+        """
+        The latest checkpoint, re-resolved only when a model directory's mtime changes
+        (saving a new checkpoint updates it), so most accesses cost one stat per directory.
+        """
+        stamp = tuple(_dir_mtime(model_dir) for model_dir in YOLO_MODEL_DIRS)
+        with self._lock:
+            if stamp != self._weights_stamp:
+                self._weights, self._weights_stamp = find_trained_yolo(), stamp
+            return self._weights
+
+    def is_available(self):
+        return self.weights is not None
+
+    def _model_name(self):
+        """Registers the current checkpoint with the model registry once; returns its name."""
+        weights = self.weights
+        model_name = f"yolo:{weights}"
+        with self._lock:
+            if model_name not in self._predict_locks:
+                def _load():
+                    from ultralytics import YOLO
+                    return YOLO(weights)
+
+                register_model(model_name, _load)
+                self._predict_locks[model_name] = threading.Lock()
+        return model_name
+
+    def load(self):
+        return get_model(self._model_name())
+
+    def predict_mask(self, im_bgr):
+        height, width = im_bgr.shape[:2]
+        model_name = self._model_name()
+        model = get_model(model_name)
+        # An Ultralytics model keeps per-call predictor state, so calls on one model must not overlap
+        with self._predict_locks[model_name]:
+            result = model.predict(im_bgr, conf=YOLO_SCORE_THRESH, retina_masks=True, verbose=False)[0]
+        if result.masks is None:
+            return np.zeros((height, width), dtype=bool)
+        # retina_masks=True returns masks at the input image resolution
+        return (result.masks.data.cpu().numpy() > 0.5).any(axis=0)
+
+    def cache_config(self):
+        return {"engine": self.name, "weights": self.weights, "score_thresh": YOLO_SCORE_THRESH}
+
+
+class OnnxEngine(SegmentationEngine):
+    """int8-quantized YOLOv8n-seg served by ONNX Runtime (see onnx_segmentor)."""
+    name = "onnx"
+    relative_cost = 1.0
+
+    def is_available(self):
+        return os.path.exists(onnx_segmentor.ONNX_INT8_MODEL_PATH)
+
+    def load(self):
+        return get_model("yolo_onnx")
+
+    def predict_mask(self, im_bgr):
+        return onnx_segmentor.predict_mask(im_bgr, self.load())
+
+    def cache_config(self):
+        return onnx_segmentor.MODEL_CONFIG
+
+
+class KeyingEngine(SegmentationEngine):
+    """
+    Keys out a plain background (see background_keying) in milliseconds, for generated
+    images. If the key fails its quality check, the image goes to the cheapest available
+    ghibli engine instead. The fallback is chosen by cheapest_engine, never by route(),
+    so forcing SEGMENTATION_BACKEND=keying cannot route back to this engine.
+    """
+    name = "keying"
+    relative_cost = 0.01
+
+    def load(self):
+        return None
+
+    def predict_mask(self, im_bgr):
+        keyed = background_keying.key_background(im_bgr, feather=0)
+        if keyed.ok:
+            return keyed.alpha > 0
+        logging.info("Background keying failed its quality check; falling back to the neural segmentor")
+        return cheapest_engine("ghibli").predict_mask(im_bgr)
+
+    def cache_config(self):
+        return {"engine": self.name, "tolerance": background_keying.KEY_TOLERANCE,
+                "fallback": cheapest_engine("ghibli").cache_config()}
+
+
+ENGINES = {
+    engine.name: engine
+    for engine in (Detectron2Engine(), YoloEngine(), OnnxEngine(), KeyingEngine())
+}
+
+# Engines considered adequate per image style, before ordering by cost. The generic
+# COCO models serve normal photos, and ghibli images when no fine-tuned checkpoint is present.
+ADEQUATE_ENGINES = {
+    "normal": ["onnx", "detectron2"],
+    "ghibli": ["yolo_ghibli", "detectron2"],
+}
+
+
+def get_engine(name):
+    """Returns the engine registered under name."""
+    if name not in ENGINES:
+        raise KeyError(f"Unknown segmentation engine '{name}'. Available: {list(ENGINES)}")
+    return ENGINES[name]
+
+
+def cheapest_engine(style):
+    """
+    Returns the cheapest available engine in ADEQUATE_ENGINES[style] ("normal" or
+    "ghibli"), or Detectron2 if none is available. Ignores SEGMENTATION_BACKEND.
+    """
+    candidates = [ENGINES[name] for name in ADEQUATE_ENGINES[style]]
+    available = [engine for engine in candidates if engine.is_available()]
+    if not available:
+        return ENGINES["detectron2"]
+    return min(available, key=lambda e: e.relative_cost)
+
+
+def route(is_image_normal=True):
+    """
+    Picks the cheapest adequate engine for an image.
+
+    Args:
+        is_image_normal (bool): Classifier verdict; False selects the ghibli-tuned models.
+
+    Returns:
+        SegmentationEngine: The engine to use.
+    """
+    if SEGMENTATION_BACKEND:
+        return get_engine(SEGMENTATION_BACKEND)
+
+    style = "ghibli" if is_image_normal is False else "normal"
+    engine = cheapest_engine(style)
+    logging.info(f"Routing {style} image to segmentation engine '{engine.name}'")
+    return engine
+
+
+def route_depends_on_verdict():
+    """
+    True if normal and ghibli images are currently routed to different engines. When they
+    are not (a forced SEGMENTATION_BACKEND, or no fine-tuned checkpoints), the classifier
+    verdict cannot change the segmentation and classifying can be skipped.
+    """
+    return route(True).name != route(False).name
+
+
+def warm_up_routes():
+    """
+    Loads the engines the router currently picks for normal and ghibli images in a
+    background daemon thread, so the first request does not pay the model load.
+
+    Returns:
+        threading.Thread: The started warm-up thread.
+    """
+    def _warm():
+        for is_image_normal in (True, False):
+            try:
+                route(is_image_normal).load()
+            except Exception as e:
+                logging.error(f"Background warm-up of segmentation engine failed: {e}")
+
+    thread = threading.Thread(target=_warm, name="engine-warm-up", daemon=True)
+    thread.start()
+    return thread
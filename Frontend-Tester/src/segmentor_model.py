@@ -3,27 +3,32 @@ import os
 from PIL import Image # Our new friend for image manipulation and WebP
 import hashlib # Import the hashlib library
 
-# Detectron2 imports
-from detectron2.config import get_cfg
-from detectron2.engine import DefaultPredictor
-# No need for Visualizer or MetadataCatalog if we're just getting masks
-
-# --- Configuration for the pre-trained Detectron2 model ---
-# Load this configuration once outside the function if segmenting many images
-# or load it inside if the script is just for one image at a time.
-# For a single script run, loading inside is fine.
-cfg = get_cfg()
-# Make sure this config file path is correct relative to where you run the script
-# or provide an absolute path.
-cfg.merge_from_file("detectron2/configs/COCO-InstanceSegmentation/mask_rcnn_R_50_FPN_3x.yaml")
-cfg.MODEL.ROI_HEADS.SCORE_THRESH_TEST = 0.7 # Set a higher threshold for cleaner results
-cfg.MODEL.DEVICE = "cpu" # !!! IMPORTANT FOR CPU !!!
-# This weight path is a URL, Detectron2 will download it if not found locally.
-cfg.MODEL.WEIGHTS = "detectron2://COCO-InstanceSegmentation/mask_rcnn_R_50_FPN_3x/137849600/model_final_f10217.pkl"
-
-# Create the predictor once
-predictor = DefaultPredictor(cfg)
-# --- End Configuration ---
+import numpy as np
+
+import seg_cache
+from segmentation_engine import SegmentationEngine, get_engine, route, get_predictor, instances_to_mask
+from tiled_segmentation import TILE_THRESHOLD_PIXELS, tiled_mask, packed_profiles, unpack_region
+
+# Number of images grouped into one forward pass by segment_batch
+BATCH_SIZE = 4
+
+# Inference resolution control for segmentor(). Uploads are downscaled so their longer
+# side is at most INFERENCE_MAX_SIDE before inference, and the mask is upsampled back.
+# With OUTPUT_RESOLUTION = "sticker" the result is written at sticker size directly,
+# since conv_to_sticker thumbnails to 512x512 anyway.
+#
+# Tiled inference (see tiled_segmentation) is opt-in only: it runs when a caller passes
+# max_side=None with output_resolution="full" and the image exceeds TILE_THRESHOLD_PIXELS.
+# The app and segment_batch always downscale to INFERENCE_MAX_SIDE, so they never tile.
+INFERENCE_MAX_SIDE = 1024
+STICKER_SIDE = 512
+OUTPUT_RESOLUTION = "full"  # "full" or "sticker"
+
+# Crop-to-subject: only the bounding box of the mask (plus padding) is encoded and
+# cached, so small subjects fill the sticker and no transparent border is stored.
+CROP_TO_SUBJECT = True
+CROP_PADDING_RATIO = 0.04  # Padding as a fraction of the subject's longer side
+
 
 def generate_image_hash(image_path):
     """
@@ -54,15 +59,25 @@ def generate_image_hash(image_path):
         return None
 
 
-def segmentor(image_path, output_dir="segmented images"):
+def segmentor(image_path, output_dir="segmented images", engine=None,
+              max_side=INFERENCE_MAX_SIDE, output_resolution=OUTPUT_RESOLUTION, crop=CROP_TO_SUBJECT):
     """
-    Loads a pre-trained Detectron2 model, performs instance segmentation,
+    Runs instance segmentation with the selected engine (routed if not given),
     isolates the segmented objects, generates a hash for the input image,
     and saves the result as a transparent WebP image using the hash in the filename.
+    Results are cached by image content and model config, so repeat uploads are
+    served from disk without running the predictor.
 
     Args:
         image_path (str): The path to the input image file.
         output_dir (str): The directory where the output transparent WebP will be saved.
+        engine (str | SegmentationEngine): Engine name (e.g. "detectron2", "onnx",
+                       "yolo_ghibli") or instance. Defaults to segmentation_engine.route().
+        max_side (int): Longer side the image is downscaled to before inference.
+                        None runs inference at full resolution.
+        output_resolution (str): "full" upsamples the mask back to the upload size,
+                                 "sticker" writes the result at STICKER_SIDE directly.
+        crop (bool): Crop the result to the subject's bounding box plus padding.
 
     Returns:
         str: The path to the saved WebP file if successful, None otherwise.
@@ -77,83 +92,302 @@ def segmentor(image_path, output_dir="segmented images"):
         print(f"Could not generate hash for {image_path}. Cannot save with hash filename.")
         return None
 
-    # Construct output path using the hash
-    output_webp_path = os.path.join(output_dir, f"{image_hash}.webp")
+    def load_image():
+        # Load the input image using OpenCV
+        # Predictor expects a numpy array in BGR format
+        print(f"Loading image from {image_path}...")
+        im_bgr = cv2.imread(image_path)
+        if im_bgr is None:
+            print(f"Error: Could not read image from {image_path}")
+        else:
+            print("Image loaded.")
+        return im_bgr
+
+    return _segment(image_hash, load_image, output_dir, engine, max_side, output_resolution, crop)
+
+
+def segment_array(im_bgr, image_hash, output_dir="segmented images", engine=None,
+                  max_side=INFERENCE_MAX_SIDE, output_resolution=OUTPUT_RESOLUTION, crop=CROP_TO_SUBJECT):
+    """
+    Same as segmentor(), for an image that is already decoded in memory (e.g. an upload
+    buffer), so the file does not have to be written, re-read or re-hashed.
+
+    Args:
+        im_bgr (numpy.ndarray): The input image in BGR format. It is only read, never modified.
+        image_hash (str): SHA256 of the original file content, used as the cache key.
+        output_dir, engine, max_side, output_resolution, crop: As for segmentor().
+
+    Returns:
+        str: The path to the saved WebP file if successful, None otherwise.
+    """
+    return _segment(image_hash, lambda: im_bgr, output_dir, engine, max_side, output_resolution, crop)
+
+
+def segmentation_config(engine, max_side=INFERENCE_MAX_SIDE, output_resolution=OUTPUT_RESOLUTION, crop=CROP_TO_SUBJECT):
+    """
+    Everything that changes a segmentation's output, as used in its seg_cache key.
+
+    Args:
+        engine (SegmentationEngine): The engine that produces the mask.
+        max_side, output_resolution, crop: As for segmentor().
+
+    Returns:
+        dict: The engine's cache_config() plus the resolution and crop settings.
+    """
+    return dict(engine.cache_config(), max_side=max_side, output=output_resolution,
+                crop=CROP_PADDING_RATIO if crop else None)
+
+
+def cutout_config(model_config, crop=CROP_TO_SUBJECT):
+    """The seg_cache config of a cut-out saved by save_cutout() with these settings."""
+    return dict(model_config, crop=CROP_PADDING_RATIO if crop else None)
+
 
-    # Check if output directory exists, create if not
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-        print(f"Created output directory: {output_dir}")
+def _segment(image_hash, load_image, output_dir, engine, max_side, output_resolution, crop):
+    """Shared body of segmentor() and segment_array(); load_image is only called on a cache miss."""
+    if engine is None:
+        engine = route()
+    elif not isinstance(engine, SegmentationEngine):
+        engine = get_engine(engine)
+    predict_mask = engine.predict_mask
+    model_config = segmentation_config(engine, max_side, output_resolution, crop)
 
+    # Return the cached segmentation if this image was already processed with this model
+    cache_key = seg_cache.make_cache_key(image_hash, model_config)
+    cached_path = seg_cache.lookup(cache_key, output_dir)
+    if cached_path is not None:
+        print(f"Using cached segmentation: {cached_path}")
+        return cached_path
 
-    # Load the input image using OpenCV
-    # Predictor expects a numpy array in BGR format
-    print(f"Loading image from {image_path}...")
-    im_bgr = cv2.imread(image_path)
+    im_bgr = load_image()
     if im_bgr is None:
-        print(f"Error: Could not read image from {image_path}")
         return None
-    print("Image loaded.")
 
-    # Run the predictor on the image
-    print("Running inference (this may take a while on CPU!)...")
-    outputs = predictor(im_bgr)
+    # Very large full-resolution inputs are segmented in tiles into a bit-packed mask
+    height, width = im_bgr.shape[:2]
+    if max_side is None and output_resolution == "full" and height * width > TILE_THRESHOLD_PIXELS:
+        print(f"Running tiled inference on {width}x{height} image...")
+        packed = tiled_mask(im_bgr, predict_mask)
+        print("Inference complete.")
+
+        bbox = _padded_bbox(*packed_profiles(packed, width)) if crop else None
+        region = bbox or (0, 0, width, height)
+        x0, y0, x1, y1 = region
+        composite_mask = unpack_region(packed, region)
+        img_rgba = build_transparent_image(im_bgr[y0:y1, x0:x1], composite_mask)
+        return save_segmentation(cache_key, img_rgba, output_dir)
+
+    # Run inference on a downscaled copy; the mask is upsampled to the output size below
+    im_infer = _resize_to_max_side(im_bgr, max_side) if max_side else im_bgr
+    if output_resolution == "sticker":
+        im_bgr = _resize_to_max_side(im_bgr, STICKER_SIDE)
+
+    print(f"Running {engine.name} inference at {im_infer.shape[1]}x{im_infer.shape[0]} (this may take a while on CPU!)...")
+    composite_mask = predict_mask(im_infer)
     print("Inference complete.")
 
-    # Extract instance predictions
-    instances = outputs["instances"]
+    composite_mask = _resize_mask(composite_mask, im_bgr.shape[:2])
 
-    # Check if any instances were detected after filtering by score threshold
-    if len(instances) == 0:
-        print("No objects detected above the score threshold.")
-        # Option: Save a fully transparent image or just exit
-        # Let's save a fully transparent image of the original size
-        height, width = im_bgr.shape[:2]
-        transparent_img = Image.new('RGBA', (width, height), (0, 0, 0, 0))
-        try:
-            transparent_img.save(output_webp_path, format='WebP')
-            print(f"Saved empty transparent image to {output_webp_path}")
-            return output_webp_path
-        except Exception as e:
-            print(f"Error saving empty transparent image: {e}")
-            return None
+    bbox = mask_bbox(composite_mask) if crop else None
+    img_rgba = build_transparent_image(im_bgr, composite_mask, bbox)
+    return save_segmentation(cache_key, img_rgba, output_dir)
 
 
-    # Get the predicted masks. These are boolean tensors/arrays [num_instances, height, width]
-    pred_masks = instances.pred_masks.to("cpu").numpy() # Move to CPU and convert to numpy
+def save_cutout(im_bgr, mask, image_hash, model_config, output_dir="segmented images", crop=CROP_TO_SUBJECT):
+    """
+    Stores a mask that did not come from a segmentation engine (e.g. an image that was
+    already a cut-out) exactly like a segmentation result.
 
-    # --- Create a composite mask ---
-    # Correct Composite Mask: True wherever *any* segmented object exists
-    composite_mask = pred_masks.any(axis=0) # This is the mask of the combined foreground objects
+    Args:
+        im_bgr (numpy.ndarray): The input image in BGR format.
+        mask (numpy.ndarray): Boolean foreground mask or uint8 alpha channel.
+        image_hash (str): SHA256 of the original file content.
+        model_config (dict): Identifies how the mask was made, for the cache key.
+        output_dir (str): The directory where the output transparent WebP will be saved.
+        crop (bool): Crop the result to the subject's bounding box plus padding.
 
-    # --- Create a transparent image ---
-    # Convert the original BGR image to RGB (Pillow works better with RGB)
-    im_rgb = cv2.cvtColor(im_bgr, cv2.COLOR_BGR2RGB)
+    Returns:
+        str: The path to the saved WebP file if successful, None otherwise.
+    """
+    cache_key = seg_cache.make_cache_key(image_hash, cutout_config(model_config, crop))
+    bbox = mask_bbox(mask > 0) if crop else None
+    return save_segmentation(cache_key, build_transparent_image(im_bgr, mask, bbox), output_dir)
 
-    # Create a new RGBA image with the same size as the original
-    # Initialize with a fully transparent background (0, 0, 0, 0)
-    height, width = im_bgr.shape[:2]
-    img_rgba = Image.new('RGBA', (width, height), (0, 0, 0, 0))
 
-    # Copy the RGB data from the original image
-    img_rgb_pil = Image.fromarray(im_rgb)
-    img_rgba.paste(img_rgb_pil, (0, 0))
+def mask_bbox(mask, padding_ratio=CROP_PADDING_RATIO):
+    """
+    Returns the padded bounding box of the True pixels of a mask.
 
-    # --- Apply the composite mask to the alpha channel ---
-    # Convert the boolean composite_mask to an 8-bit grayscale image (0-255)
-    # Pixels in the composite_mask that are True (foreground) become 255 (fully opaque)
-    # Pixels that are False (background) become 0 (fully transparent)
-    alpha_channel = Image.fromarray(composite_mask.astype('uint8') * 255, 'L') # 'L' mode for grayscale
+    Args:
+        mask (numpy.ndarray): Boolean [height, width] mask.
+        padding_ratio (float): Padding added on every side, as a fraction of the box's longer side.
 
-    # Put the new alpha channel into the RGBA image
-    img_rgba.putalpha(alpha_channel)
+    Returns:
+        tuple: (x0, y0, x1, y1) clipped to the mask, or None if the mask is empty.
+    """
+    return _padded_bbox(mask.any(axis=1), mask.any(axis=0), padding_ratio)
 
-    # --- Save the final image as WebP ---
+
+def _padded_bbox(rows_any, cols_any, padding_ratio=CROP_PADDING_RATIO):
+    """Padded bounding box from per-row and per-column occupancy vectors."""
+    rows = np.flatnonzero(rows_any)
+    if rows.size == 0:
+        return None
+    cols = np.flatnonzero(cols_any)
+    y0, y1 = int(rows[0]), int(rows[-1]) + 1
+    x0, x1 = int(cols[0]), int(cols[-1]) + 1
+
+    pad = int(round(padding_ratio * max(x1 - x0, y1 - y0)))
+    height, width = len(rows_any), len(cols_any)
+    return (max(0, x0 - pad), max(0, y0 - pad), min(width, x1 + pad), min(height, y1 + pad))
+
+
+def build_transparent_image(im_bgr, composite_mask, bbox=None):
+    """
+    Applies the composite foreground mask as the alpha channel of the original image.
+
+    RGB and alpha are written into a single preallocated HxWx4 buffer which Pillow
+    wraps without copying, instead of building the RGBA image through several PIL passes.
+
+    Args:
+        im_bgr (numpy.ndarray): The input image in BGR format.
+        composite_mask (numpy.ndarray): Boolean [height, width] foreground mask, or a
+                                        uint8 alpha channel used as is.
+        bbox (tuple): Optional (x0, y0, x1, y1) region to keep; the rest is cropped away
+                      before any pixels are copied.
+
+    Returns:
+        PIL.Image.Image: RGBA image, fully transparent if nothing was detected.
+    """
+    if not composite_mask.any():
+        print("No objects detected above the score threshold.")
+        # Let's save a fully transparent image of the original size
+        height, width = im_bgr.shape[:2]
+        return Image.new('RGBA', (width, height), (0, 0, 0, 0))
+
+    if bbox is not None:
+        x0, y0, x1, y1 = bbox
+        im_bgr = im_bgr[y0:y1, x0:x1]
+        composite_mask = composite_mask[y0:y1, x0:x1]
+
+    height, width = im_bgr.shape[:2]
+    rgba = np.empty((height, width, 4), dtype=np.uint8)
+    rgba[..., :3] = im_bgr[..., ::-1]  # BGR -> RGB straight into the output buffer
+    if composite_mask.dtype == np.uint8:
+        # Already an alpha channel (e.g. from a cut-out PNG): keep its soft edges
+        rgba[..., 3] = composite_mask
+    else:
+        # Foreground (True) becomes 255 (fully opaque), background becomes 0 (fully transparent)
+        np.multiply(composite_mask, 255, out=rgba[..., 3], casting="unsafe")
+    return Image.fromarray(rgba, 'RGBA')
+
+
+def save_segmentation(cache_key, img_rgba, output_dir):
+    """
+    Saves a segmented RGBA image as WebP through the segmentation cache.
+
+    Returns:
+        str: The path to the saved WebP file if successful, None otherwise.
+    """
     try:
-        img_rgba.save(output_webp_path, format='WebP')
+        output_webp_path = seg_cache.store(cache_key, img_rgba, output_dir)
         print(f"Successfully saved segmented transparent image to {output_webp_path}")
         return output_webp_path
     except Exception as e:
         print(f"Error saving image as WebP: {e}")
         print("Make sure your Pillow installation supports WebP.")
-        return None
\ No newline at end of file
+        return None
+
+
+def _resize_to_max_side(im_bgr, max_side):
+    """Downscales an image so its longer side is at most max_side (never upscales)."""
+    height, width = im_bgr.shape[:2]
+    scale = max_side / max(height, width)
+    if scale >= 1:
+        return im_bgr
+    new_size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return cv2.resize(im_bgr, new_size, interpolation=cv2.INTER_AREA)
+
+
+def _resize_mask(mask, shape):
+    """Resizes a boolean mask to (height, width) with bilinear interpolation and re-thresholds it."""
+    height, width = shape
+    if mask.shape == (height, width):
+        return mask
+    resized = cv2.resize(mask.view(np.uint8) * np.uint8(255), (width, height), interpolation=cv2.INTER_LINEAR)
+    return resized > 127
+
+
+def segment_batch(image_paths, output_dir="segmented images", batch_size=BATCH_SIZE, max_side=INFERENCE_MAX_SIDE,
+                  crop=CROP_TO_SUBJECT):
+    """
+    Segments several images, running the cache misses through the model in batched
+    forward passes instead of one predictor call per image.
+
+    Args:
+        image_paths (list[str]): Paths to the input image files.
+        output_dir (str): The directory where the output transparent WebPs will be saved.
+        batch_size (int): Number of images per forward pass.
+        max_side (int): Inference resize policy, as for segmentor(). If set, inference runs
+                        on a copy downscaled so its longer side is at most max_side, and
+                        the mask is upsampled back; outputs always keep full size, so
+                        results share cache entries with segmentor(engine="detectron2").
+        crop (bool): Crop each result to the subject's bounding box plus padding.
+
+    Returns:
+        list[str]: Path to the saved WebP for each input (None where it failed), in input order.
+    """
+    results = [None] * len(image_paths)
+    model_config = segmentation_config(get_engine("detectron2"), max_side, "full", crop)
+    pending = []  # (index, cache_key, im_bgr, im_infer) for every cache miss
+
+    for index, image_path in enumerate(image_paths):
+        if not os.path.exists(image_path):
+            print(f"Error: Image file not found at {image_path}")
+            continue
+        image_hash = generate_image_hash(image_path)
+        if image_hash is None:
+            continue
+
+        cache_key = seg_cache.make_cache_key(image_hash, model_config)
+        cached_path = seg_cache.lookup(cache_key, output_dir)
+        if cached_path is not None:
+            results[index] = cached_path
+            continue
+
+        im_bgr = cv2.imread(image_path)
+        if im_bgr is None:
+            print(f"Error: Could not read image from {image_path}")
+            continue
+        im_infer = _resize_to_max_side(im_bgr, max_side) if max_side else im_bgr
+        pending.append((index, cache_key, im_bgr, im_infer))
+
+    if not pending:
+        return results
+
+    import torch
+    predictor = get_predictor()
+    for start in range(0, len(pending), batch_size):
+        batch = pending[start:start + batch_size]
+        print(f"Running batched inference on {len(batch)} images...")
+        inputs = []
+        for _, _, _, im_infer in batch:
+            # Same preprocessing as DefaultPredictor.__call__, applied per image
+            original_image = im_infer[:, :, ::-1] if predictor.input_format == "RGB" else im_infer
+            height, width = original_image.shape[:2]
+            image = predictor.aug.get_transform(original_image).apply_image(original_image)
+            image = torch.as_tensor(image.astype("float32").transpose(2, 0, 1))
+            inputs.append({"image": image, "height": height, "width": width})
+
+        with torch.no_grad():
+            outputs = predictor.model(inputs)
+        print("Batched inference complete.")
+
+        for (index, cache_key, im_bgr, im_infer), output in zip(batch, outputs):
+            composite_mask = instances_to_mask(output["instances"], *im_infer.shape[:2])
+            composite_mask = _resize_mask(composite_mask, im_bgr.shape[:2])
+            bbox = mask_bbox(composite_mask) if crop else None
+            img_rgba = build_transparent_image(im_bgr, composite_mask, bbox)
+            results[index] = save_segmentation(cache_key, img_rgba, output_dir)
+
+    return results
@@ -1,50 +1,264 @@
-from datetime import datetime
-import os, io, logging, piexif
+from functools import lru_cache
+import os, math, logging, piexif
 
-from PIL import Image, ImageDraw, ImageFont
-from fonts import get_font
+from PIL import Image, ImageDraw, ImageOps
+import sticker_store, result_cache
+from fonts import load_font, text_length, font_cache
+from caption_layout import fit_caption, MAX_CAPTION_HEIGHT_RATIO
+from webp_encoder import (encode_to_budget, encode_animation_to_budget,
+                          WHATSAPP_STATIC_MAX_BYTES, WHATSAPP_ANIMATED_MAX_BYTES)
 
 # Configuration
 OUTPUT_DIR = "stickers"
 WHATSAPP_MAX_SIZE = (512, 512)
-DEFAULT_FONT_SIZE = 40
 BACKGROUND_COLOR = (0, 0, 0, 0)  # Transparent
+CAPTION_STROKE_WIDTH = 1
+CAPTION_STROKE_COLOR = "black"
+CAPTION_CACHE_SIZE = 256  # Rendered caption layers kept in the LRU cache
+CAPTION_TOP_MARGIN = 20  # px from the top of the sticker to the first caption line
+CAPTION_SIDE_MARGIN = 16  # px kept free on the left and right of the caption
 
-def create_whatsapp_sticker(image, output_path):
-    """Final processing to make image WhatsApp-compatible"""
-    try:
-        # Generate minimal EXIF metadata required for WhatsApp stickers
-        exif_dict = {
-            "0th": {
-                piexif.ImageIFD.Make: "WhatsApp",
-                piexif.ImageIFD.Software: "AI Sticker Studio"
-            },
-            "Exif": {},
-            "GPS": {},
-            "Interop": {},
-            "1st": {},
-            "thumbnail": None
-        }
-        exif_bytes = piexif.dump(exif_dict)
-
-        # Save as WebP first (without EXIF)
-        output_io = io.BytesIO()
-        image.save(output_io, format="WEBP", lossless=True)  # Lossless WebP for stickers
-
-        # Write WebP to file
-        with open(output_path, "wb") as f:
-            f.write(output_io.getvalue())
-
-        # Inject EXIF metadata
-        piexif.insert(exif_bytes, output_path)
-        
-        return True
-    except Exception as e:
-        logging.error(f"Error creating WhatsApp sticker: {e}")
-        return False
+# Animated stickers
+ANIMATION_EFFECTS = ("pop", "wobble")
+ANIMATION_FRAMES = 16
+ANIMATION_FRAME_MS = 60
+WOBBLE_DEGREES = 6  # Peak rotation of the subject for the "wobble" effect
+
+# Minimal EXIF metadata required for WhatsApp stickers, built once per process
+WHATSAPP_EXIF = piexif.dump({
+    "0th": {
+        piexif.ImageIFD.Make: "WhatsApp",
+        piexif.ImageIFD.Software: "AI Sticker Studio"
+    },
+    "Exif": {},
+    "GPS": {},
+    "Interop": {},
+    "1st": {},
+    "thumbnail": None
+})
+
+def encode_whatsapp_sticker(image):
+    """
+    Encodes a sticker as WebP within WhatsApp's 100 KB limit, with the EXIF chunk
+    embedded, entirely in memory. Lossless is used whenever it fits the budget.
+
+    Returns:
+        bytes: The complete WebP file, ready to be written or served.
+    """
+    # Pillow writes the EXIF chunk into the RIFF container during the same encode
+    data, _ = encode_to_budget(image, WHATSAPP_STATIC_MAX_BYTES, exif=WHATSAPP_EXIF)
+    return data
+
+@font_cache
+@lru_cache(maxsize=CAPTION_CACHE_SIZE)
+def render_caption_layer(caption, font_name, font_size, color):
+    """
+    Rasterises a caption with its outline in a single pass and caches the result.
+
+    Args:
+        caption (str): The caption text.
+        font_name (str): Bundled font name, e.g. "Bangers" (default font if unknown).
+        font_size (int): Font size in points.
+        color (str | tuple): Fill color of the text.
+
+    Returns:
+        tuple: (layer, offset, text_width) where layer is a tightly cropped RGBA image,
+               offset is its (x, y) position relative to the text origin and text_width
+               is the advance width used for centering.
+    """
+    font = load_font(font_name, font_size)
+    left, top, right, bottom = font.getbbox(caption, stroke_width=CAPTION_STROKE_WIDTH)
+    layer = Image.new("RGBA", (max(1, right - left), max(1, bottom - top)), BACKGROUND_COLOR)
+    ImageDraw.Draw(layer).text(
+        (-left, -top),
+        caption,
+        fill=color,
+        font=font,
+        stroke_width=CAPTION_STROKE_WIDTH,
+        stroke_fill=CAPTION_STROKE_COLOR
+    )
+    return layer, (left, top), text_length(caption, font_name, font_size)
+
+
+def paste_layer(canvas, layer, position):
+    """Alpha-composites an RGBA layer onto the canvas, clipping anything outside it."""
+    x, y = position
+    canvas.alpha_composite(layer, (max(0, x), max(0, y)), (max(0, -x), max(0, -y)))
+
+
+def compose_layers(image, caption, color, font_name):
+    """
+    Lays out the 512x512 sticker without flattening it: the caption is fitted into a band
+    at the top and the subject (the bounding box of its opaque pixels) is scaled into the
+    space below it.
+
+    Args:
+        image (PIL.Image.Image): Segmented RGBA image.
+        caption (str): Caption text (may be empty).
+        color (str | tuple): Caption fill color.
+        font_name (str): Font name, e.g. "Bangers" or "Bangers-Regular".
+
+    Returns:
+        tuple: (subject, subject_position, caption_layer) where caption_layer is a
+               sticker-sized RGBA layer holding every caption line, or None.
+    """
+    font_name = font_name.replace("-Regular", "")
+    width, height = WHATSAPP_MAX_SIZE
+
+    # 1. Lay out the caption first so the subject can be kept clear of it
+    caption_layer = None
+    caption_bottom = 0
+    if caption:
+        layout = fit_caption(
+            caption, font_name,
+            width - 2 * CAPTION_SIDE_MARGIN,
+            int(height * MAX_CAPTION_HEIGHT_RATIO)
+        )
+        caption_bottom = CAPTION_TOP_MARGIN + layout.height
+
+        # Draw the caption lines, each centered horizontally
+        caption_layer = Image.new("RGBA", WHATSAPP_MAX_SIZE, BACKGROUND_COLOR)
+        for index, line in enumerate(layout.lines):
+            layer, (dx, dy), text_width = render_caption_layer(line, font_name, layout.font_size, color)
+            text_position = (
+                int((width - text_width) // 2),
+                CAPTION_TOP_MARGIN + index * layout.line_height
+            )
+            paste_layer(caption_layer, layer, (text_position[0] + dx, text_position[1] + dy))
+
+    # 2. Scale the subject up or down into the area below the caption
+    subject_bbox = image.getbbox()
+    if subject_bbox:
+        image = image.crop(subject_bbox)
+    area_height = height - caption_bottom
+    image = ImageOps.contain(image, (width, area_height), Image.LANCZOS)
+    x_offset = (width - image.size[0]) // 2
+    y_offset = caption_bottom + (area_height - image.size[1]) // 2
+
+    return image, (x_offset, y_offset), caption_layer
+
+
+def render_sticker(image, caption, color, font_name):
+    """
+    Composes the 512x512 sticker: caption band at the top, subject below it.
+
+    Args:
+        image (PIL.Image.Image): Segmented RGBA image.
+        caption (str): Caption text (may be empty).
+        color (str | tuple): Caption fill color.
+        font_name (str): Font name, e.g. "Bangers" or "Bangers-Regular".
+
+    Returns:
+        PIL.Image.Image: The RGBA sticker.
+    """
+    subject, position, caption_layer = compose_layers(image, caption, color, font_name)
+    sticker = Image.new("RGBA", WHATSAPP_MAX_SIZE, BACKGROUND_COLOR)
+    sticker.alpha_composite(subject, position)
+    if caption_layer is not None:
+        sticker.alpha_composite(caption_layer)
+    return sticker
 
-def conv_to_sticker(seg_img_path, caption, color, font_name, log_filename=None):
-    """Generates a WhatsApp-compatible sticker with caption at the TOP"""
+
+def _pop_scale(t):
+    """Caption scale at animation time t in [0, 1]: overshoots, settles by t=0.5, then holds."""
+    if t >= 0.5:
+        return 1.0
+    u = t / 0.5 - 1
+    return 1 + 2.7 * u ** 3 + 1.7 * u ** 2  # ease-out-back
+
+
+def iter_animation_frames(image, caption, color, font_name, effect="pop"):
+    """
+    Renders the frames of an animated sticker lazily from one segmented image.
+
+    The layout, the subject resize and the caption layer are computed once; each frame
+    only transforms and composites them. "pop" scales the caption in over a still subject
+    (the settled frames are identical, so the encoder merges them into one); "wobble"
+    rocks the subject under a static caption.
+
+    Args:
+        image (PIL.Image.Image): Segmented RGBA image.
+        caption (str): Caption text (may be empty).
+        color (str | tuple): Caption fill color.
+        font_name (str): Font name, e.g. "Bangers" or "Bangers-Regular".
+        effect (str): One of ANIMATION_EFFECTS.
+
+    Yields:
+        tuple: (frame, duration_ms) with frame a 512x512 RGBA image.
+    """
+    if effect not in ANIMATION_EFFECTS:
+        raise ValueError(f"Unknown animation effect '{effect}'. Available: {ANIMATION_EFFECTS}")
+
+    subject, position, caption_layer = compose_layers(image, caption, color, font_name)
+
+    if effect == "pop":
+        base = Image.new("RGBA", WHATSAPP_MAX_SIZE, BACKGROUND_COLOR)
+        base.alpha_composite(subject, position)
+        caption_bbox = caption_layer.getbbox() if caption_layer is not None else None
+        if caption_bbox:
+            caption_block = caption_layer.crop(caption_bbox)
+            center_x = (caption_bbox[0] + caption_bbox[2]) / 2
+            center_y = (caption_bbox[1] + caption_bbox[3]) / 2
+        for index in range(ANIMATION_FRAMES):
+            frame = base.copy()
+            if caption_bbox:
+                scale = _pop_scale(index / (ANIMATION_FRAMES - 1))
+                if scale == 1.0:
+                    frame.alpha_composite(caption_layer)
+                elif scale > 0.05:
+                    size = (max(1, round(caption_block.size[0] * scale)), max(1, round(caption_block.size[1] * scale)))
+                    scaled = caption_block.resize(size, Image.BILINEAR)
+                    paste_layer(frame, scaled, (round(center_x - size[0] / 2), round(center_y - size[1] / 2)))
+            yield frame, ANIMATION_FRAME_MS
+
+    elif effect == "wobble":
+        center_x = position[0] + subject.size[0] / 2
+        center_y = position[1] + subject.size[1] / 2
+        for index in range(ANIMATION_FRAMES):
+            angle = WOBBLE_DEGREES * math.sin(2 * math.pi * index / ANIMATION_FRAMES)
+            rotated = subject.rotate(angle, Image.BICUBIC, expand=True)
+            frame = Image.new("RGBA", WHATSAPP_MAX_SIZE, BACKGROUND_COLOR)
+            paste_layer(frame, rotated, (round(center_x - rotated.size[0] / 2), round(center_y - rotated.size[1] / 2)))
+            if caption_layer is not None:
+                frame.alpha_composite(caption_layer)
+            yield frame, ANIMATION_FRAME_MS
+
+
+def encode_animated_sticker(image, caption, color, font_name, effect="pop"):
+    """
+    Encodes an animated sticker within WhatsApp's 500 KB limit, with the EXIF chunk
+    embedded. Frames are rendered and encoded one at a time.
+
+    Returns:
+        bytes: The complete animated WebP file.
+    """
+    data, _ = encode_animation_to_budget(
+        lambda: iter_animation_frames(image, caption, color, font_name, effect),
+        WHATSAPP_ANIMATED_MAX_BYTES,
+        exif=WHATSAPP_EXIF
+    )
+    return data
+
+
+def segmented_image_hash(seg_img_path):
+    """
+    Content hash of a segmented image, memoized in the result cache. Entries are keyed by
+    inode and size as well as the path, so a file replaced in place is hashed again.
+    """
+    st = os.stat(seg_img_path)
+    cache_key = f"{os.path.abspath(seg_img_path)}|{st.st_ino}|{st.st_size}"
+    seg_hash = result_cache.get("seg_hash", cache_key)
+    if seg_hash is None:
+        seg_hash = sticker_store.hash_file(seg_img_path)
+        result_cache.put("seg_hash", cache_key, seg_hash)
+    return seg_hash
+
+
+def conv_to_sticker(seg_img_path, caption, color, font_name, log_filename=None, animation=None):
+    """
+    Generates a WhatsApp-compatible sticker with caption at the TOP.
+    With animation set to one of ANIMATION_EFFECTS, an animated sticker is produced instead.
+    """
     # Setup logging
     if log_filename:
         logging.basicConfig(
@@ -58,55 +272,29 @@ def conv_to_sticker(seg_img_path, caption, color, font_name, log_filename=None):
         # 1. Load and validate image
         if not os.path.exists(seg_img_path):
             raise FileNotFoundError(f"Image not found at {seg_img_path}")
-            
+
+        # 2. Stickers are content-addressed: an identical request returns the existing file
+        key = sticker_store.make_sticker_key(
+            segmented_image_hash(seg_img_path), caption, color, font_name, animation
+        )
+        existing_path = sticker_store.lookup(key, OUTPUT_DIR)
+        if existing_path:
+            return existing_path
+
         image = Image.open(seg_img_path).convert("RGBA")
-        
-        # 2. Process image to sticker format
-        image.thumbnail(WHATSAPP_MAX_SIZE, Image.LANCZOS)
-        sticker = Image.new("RGBA", WHATSAPP_MAX_SIZE, BACKGROUND_COLOR)
-        x_offset = (WHATSAPP_MAX_SIZE[0] - image.size[0]) // 2
-        y_offset = (WHATSAPP_MAX_SIZE[1] - image.size[1]) // 2
-        sticker.paste(image, (x_offset, y_offset), image)
-        
-        # 3. Add caption if provided
-        if caption:
-            # Get font (with fallback)
-            font_path = get_font(font_name.replace("-Regular", ""), log_filename)
-            try:
-                font = ImageFont.truetype(font_path, DEFAULT_FONT_SIZE) if font_path else ImageFont.load_default()
-            except:
-                font = ImageFont.load_default()
-                logging.warning(f"Using default font - couldn't load {font_name}")
-            
-            # Calculate text position (centered at TOP)
-            draw = ImageDraw.Draw(sticker)
-            text_width = draw.textlength(caption, font=font)
-            text_position = (
-                (WHATSAPP_MAX_SIZE[0] - text_width) // 2,  # Center horizontally
-                20  # 20px from top
-            )
-            
-            # Add text with outline for better visibility
-            for x_shift in [-1, 0, 1]:
-                for y_shift in [-1, 0, 1]:
-                    if x_shift or y_shift:
-                        draw.text(
-                            (text_position[0] + x_shift, text_position[1] + y_shift),
-                            caption,
-                            fill="black",
-                            font=font
-                        )
-            draw.text(text_position, caption, fill=color, font=font)
-        
+
+        if animation:
+            # 3. Render and encode the animated sticker frame by frame
+            data = encode_animated_sticker(image, caption, color, font_name, animation)
+        else:
+            # 3. Compose the sticker (auto-fitted caption at the top, subject below)
+            data = encode_whatsapp_sticker(render_sticker(image, caption, color, font_name))
+
         # 4. Save as WhatsApp-compatible sticker
-        os.makedirs(OUTPUT_DIR, exist_ok=True)
-        output_filename = f"sticker_{caption}_{datetime.now().strftime('%H-%M-%S')}.webp"
-        output_path = os.path.join(OUTPUT_DIR, output_filename)
-        
-        if create_whatsapp_sticker(sticker, output_path):
-            logging.info(f"Successfully created sticker: {output_path}")
-            return output_path
-        
+        output_path = sticker_store.store(key, data, OUTPUT_DIR)
+        logging.info(f"Successfully created sticker: {output_path}")
+        return output_path
+
     except Exception as e:
         logging.error(f"Error generating sticker: {e}")
     
@@ -122,7 +310,6 @@ if __name__ == "__main__":
     # Configuration
     OUTPUT_DIR = "stickers_new"
     WHATSAPP_MAX_SIZE = (512, 512)
-    DEFAULT_FONT_SIZE = 40
     BACKGROUND_COLOR = (0, 0, 0, 0)
 
     sticker_path = conv_to_sticker(image_path, caption, color, font_name)
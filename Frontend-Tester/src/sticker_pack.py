@@ -0,0 +1,107 @@
+from concurrent.futures import ThreadPoolExecutor
+import os, io, json, uuid, logging, zipfile
+
+from PIL import Image, ImageOps
+
+from sticker_generator import render_sticker, encode_whatsapp_sticker
+
+# --- Configuration for WhatsApp sticker packs ---
+PACK_DIR = "sticker packs"
+MIN_PACK_SIZE = 3
+MAX_PACK_SIZE = 30
+TRAY_ICON_SIZE = (96, 96)
+PACK_WORKERS = min(8, os.cpu_count() or 1)
+DEFAULT_STYLE = {"color": "#FFFFFF", "font": "Bangers"}
+
+
+def _broadcast(value, count):
+    """Turns a single value into a list of count copies; lists are returned unchanged."""
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [value] * count
+
+
+def _tray_icon(sticker):
+    """Renders the 96x96 PNG tray icon WhatsApp requires for a pack."""
+    icon = Image.new("RGBA", TRAY_ICON_SIZE, (0, 0, 0, 0))
+    thumb = ImageOps.contain(sticker, TRAY_ICON_SIZE, Image.LANCZOS)
+    icon.alpha_composite(thumb, ((TRAY_ICON_SIZE[0] - thumb.size[0]) // 2, (TRAY_ICON_SIZE[1] - thumb.size[1]) // 2))
+    output_io = io.BytesIO()
+    icon.save(output_io, format="PNG", optimize=True)
+    return output_io.getvalue()
+
+
+def build_sticker_pack(images, captions, style=None, output_path=None, name="AI Sticker Studio",
+                       publisher="AI Sticker Studio"):
+    """
+    Renders a WhatsApp sticker pack in parallel and writes it as one zip.
+
+    Stickers are rendered on a thread pool (Pillow releases the GIL while resizing and
+    encoding). Source images are decoded once and shared between stickers, and fonts and
+    caption layers come from the process-wide caches. Each sticker is written into the zip
+    as soon as it is ready, in order, followed by the tray icon and the manifest.
+
+    Args:
+        images (str | list[str]): Segmented image path(s). A single path is reused for every sticker.
+        captions (str | list[str]): Caption(s). A single caption is reused for every sticker.
+        style (dict): {"color": ..., "font": ...} shared by the whole pack.
+        output_path (str): Where to write the zip. Defaults to PACK_DIR/pack_<identifier>.zip.
+        name (str): Pack name for the manifest.
+        publisher (str): Pack publisher for the manifest.
+
+    Returns:
+        str: Path to the written zip, or None if the pack could not be built.
+    """
+    style = dict(DEFAULT_STYLE, **(style or {}))
+    count = max(len(images) if isinstance(images, (list, tuple)) else 1,
+                len(captions) if isinstance(captions, (list, tuple)) else 1)
+    images, captions = _broadcast(images, count), _broadcast(captions, count)
+
+    if len(images) != len(captions):
+        logging.error(f"Sticker pack needs as many images as captions ({len(images)} vs {len(captions)})")
+        return None
+    if not MIN_PACK_SIZE <= count <= MAX_PACK_SIZE:
+        logging.error(f"Sticker packs must have {MIN_PACK_SIZE}-{MAX_PACK_SIZE} stickers, got {count}")
+        return None
+
+    # A random identifier, so packs built in the same second never share a file or an identifier
+    identifier = uuid.uuid4().hex
+    if output_path is None:
+        os.makedirs(PACK_DIR, exist_ok=True)
+        output_path = os.path.join(PACK_DIR, f"pack_{identifier}.zip")
+
+    try:
+        # Decode every distinct source image once; the renders only read from them
+        sources = {path: Image.open(path).convert("RGBA") for path in dict.fromkeys(images)}
+
+        def render(index):
+            sticker = render_sticker(sources[images[index]], captions[index], style["color"], style["font"])
+            return sticker, encode_whatsapp_sticker(sticker)
+
+        manifest = {
+            "identifier": identifier,
+            "name": name,
+            "publisher": publisher,
+            "tray_image_file": "tray.png",
+            "stickers": [],
+        }
+        tray_png = None
+
+        # Stored, not deflated: WebP and PNG are already compressed
+        with zipfile.ZipFile(output_path, "w", compression=zipfile.ZIP_STORED) as pack, \
+                ThreadPoolExecutor(max_workers=PACK_WORKERS) as executor:
+            for index, (sticker, webp_bytes) in enumerate(executor.map(render, range(count)), start=1):
+                image_file = f"{index:02d}.webp"
+                pack.writestr(image_file, webp_bytes)
+                manifest["stickers"].append({"image_file": image_file, "emojis": []})
+                if tray_png is None:
+                    tray_png = _tray_icon(sticker)
+
+            pack.writestr("tray.png", tray_png)
+            pack.writestr("contents.json", json.dumps(manifest, indent=2))
+
+        logging.info(f"Sticker pack with {count} stickers written to: {output_path}")
+        return output_path
+    except Exception as e:
+        logging.error(f"Error building sticker pack: {e}")
+        return None
@@ -0,0 +1,166 @@
+import os, json, time, hashlib, logging, threading
+
+# --- Configuration for the content-addressed sticker store ---
+# A sticker is named after a hash of everything that determines its pixels, so an
+# identical request maps to the same file and is served without rendering again.
+STICKER_DIR = "stickers"
+LAYOUT_VERSION = 1  # Bump whenever rendering changes, so stale stickers are not reused
+STICKER_GC_GRACE_SECONDS = 60 * 60  # Unleased stickers are kept this long after their last request
+STICKER_LEASE_SECONDS = 60 * 60  # How long a sticker shown to a session is protected from GC
+STICKER_GC_INTERVAL_SECONDS = 10 * 60  # How often the background collector runs
+
+_lock = threading.Lock()
+_leases = {}  # sticker_dir -> {key: lease expiry (epoch seconds)}, in memory only
+_collector = None
+
+
+def hash_file(path):
+    """Returns the SHA256 of a file's content, read in chunks."""
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def make_sticker_key(seg_image_hash, caption, color, font_name, animation=None):
+    """
+    Builds the content-addressed key of one sticker.
+
+    Args:
+        seg_image_hash (str): SHA256 of the segmented image content.
+        caption (str): Caption text.
+        color (str | tuple): Caption fill color.
+        font_name (str): Font name; "Bangers" and "Bangers-Regular" are the same font.
+        animation (str): Animation effect, or None for a static sticker.
+
+    Returns:
+        str: Hexadecimal SHA256 of the canonicalised request and LAYOUT_VERSION.
+    """
+    blob = json.dumps({
+        "image": seg_image_hash,
+        "caption": caption,
+        "color": str(color).lower(),
+        "font": font_name.replace("-Regular", ""),
+        "animation": animation,
+        "layout": LAYOUT_VERSION,
+    }, sort_keys=True)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def sticker_path(key, sticker_dir=STICKER_DIR):
+    """Returns the on-disk location of a sticker."""
+    return os.path.join(sticker_dir, f"{key}.webp")
+
+
+def lookup(key, sticker_dir=STICKER_DIR):
+    """
+    Returns the path of an existing sticker, or None if it has not been rendered yet.
+    A hit refreshes the file's mtime so the garbage collector's grace period restarts.
+    """
+    path = sticker_path(key, sticker_dir)
+    try:
+        os.utime(path, None)
+    except OSError:
+        return None
+    logging.info(f"Sticker store hit: {path}")
+    return path
+
+
+def store(key, data, sticker_dir=STICKER_DIR):
+    """
+    Writes an encoded sticker under its key.
+
+    Args:
+        key (str): Key from make_sticker_key.
+        data (bytes): The complete WebP file.
+        sticker_dir (str): Directory holding the stickers.
+
+    Returns:
+        str: Path to the stored sticker.
+    """
+    os.makedirs(sticker_dir, exist_ok=True)
+    path = sticker_path(key, sticker_dir)
+    # Write to a temporary file first so a concurrent lookup never sees a half-written sticker
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return path
+
+
+def lease(key, seconds=STICKER_LEASE_SECONDS, sticker_dir=STICKER_DIR):
+    """
+    Protects a sticker from garbage collection for the next seconds (e.g. while it is
+    shown to a user). Leasing again extends the lease; an expired lease needs no release,
+    so stickers of closed sessions become collectable on their own.
+
+    Returns:
+        float: The time (epoch seconds) the lease expires.
+    """
+    expires = time.time() + seconds
+    with _lock:
+        leases = _leases.setdefault(sticker_dir, {})
+        leases[key] = max(expires, leases.get(key, 0))
+        return leases[key]
+
+
+def collect_garbage(sticker_dir=STICKER_DIR, grace_seconds=STICKER_GC_GRACE_SECONDS):
+    """
+    Deletes stickers that hold no unexpired lease and that have not been requested for
+    grace_seconds. Expired leases are dropped. Files not named after a sticker key are
+    left alone.
+
+    Returns:
+        int: Number of removed stickers.
+    """
+    now = time.time()
+    cutoff = now - grace_seconds
+    removed = 0
+    with _lock:
+        leases = _leases.setdefault(sticker_dir, {})
+        for key in [key for key, expires in leases.items() if expires <= now]:
+            del leases[key]
+        try:
+            entries = list(os.scandir(sticker_dir))
+        except FileNotFoundError:
+            return 0
+        for entry in entries:
+            key, ext = os.path.splitext(entry.name)
+            if ext != ".webp" or len(key) != 64 or key in leases:
+                continue
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    removed += 1
+            except OSError as e:
+                logging.warning(f"Could not remove sticker {entry.path}: {e}")
+    if removed:
+        logging.info(f"Sticker garbage collection removed {removed} unleased stickers")
+    return removed
+
+
+def start_collector(sticker_dir=STICKER_DIR, interval_seconds=STICKER_GC_INTERVAL_SECONDS):
+    """
+    Starts a daemon thread that runs collect_garbage every interval_seconds (the first
+    time right away), so stickers are reclaimed while the server runs and leases taken
+    in the meantime are honoured. Later calls return the running thread.
+
+    Returns:
+        threading.Thread: The collector thread.
+    """
+    global _collector
+
+    def _run():
+        while True:
+            try:
+                collect_garbage(sticker_dir)
+            except Exception as e:
+                logging.error(f"Sticker garbage collection failed: {e}")
+            time.sleep(interval_seconds)
+
+    with _lock:
+        if _collector is None:
+            _collector = threading.Thread(target=_run, name="sticker-gc", daemon=True)
+            _collector.start()
+        return _collector
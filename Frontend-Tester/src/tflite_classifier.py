@@ -0,0 +1,164 @@
+import os, glob, logging
+import numpy as np
+
+from model_registry import register_model, get_model
+
+# --- Configuration for the TFLite Ghibli/normal classifier ---
+# The Keras MobileNet is exported once to an int8 TFLite model (export_tflite). At run time
+# only the TFLite interpreter is needed, so the app never imports TensorFlow for the classifier.
+KERAS_CLASSIFIER_PATH = "models/Ghibli-normal-classifier/Mobilenet_ghibli_normal.h5"
+TFLITE_CLASSIFIER_PATH = "models/Ghibli-normal-classifier/Mobilenet_ghibli_normal.int8.tflite"
+TFLITE_NUM_THREADS = int(os.environ.get("TFLITE_NUM_THREADS", os.cpu_count() or 1))
+CALIBRATION_DIRS = ("uploads", "ghibli images")  # Sample images for int8 calibration
+CALIBRATION_IMAGES = 100
+
+
+def classifier_identity(model_path):
+    """
+    Identifies one classifier build: its file name plus modification time. Cached verdicts
+    are keyed on it, so switching backend or retraining never reuses stale verdicts.
+    """
+    try:
+        return f"{os.path.basename(model_path)}@{os.stat(model_path).st_mtime_ns}"
+    except OSError:
+        return os.path.basename(model_path)
+
+
+def _interpreter_class():
+    """
+    Returns the lightest available TFLite Interpreter: the standalone runtime
+    (tflite-runtime, or its successor ai-edge-litert), falling back to tf.lite.
+    """
+    try:
+        from tflite_runtime.interpreter import Interpreter
+        return Interpreter
+    except ImportError:
+        pass
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+        return Interpreter
+    except ImportError:
+        pass
+    logging.warning("No standalone TFLite runtime installed; falling back to tf.lite (imports TensorFlow)")
+    import tensorflow as tf
+    return tf.lite.Interpreter
+
+
+def _calibration_images(dirs=CALIBRATION_DIRS, limit=CALIBRATION_IMAGES):
+    """Yields float32 [1, 224, 224, 3] classifier inputs from sample images for int8 calibration."""
+    import cv2
+    from check_conv_ghibli import classifier_input
+
+    paths = sorted(
+        p for d in dirs for ext in ("*.jpg", "*.jpeg", "*.png", "*.JPG")
+        for p in glob.glob(os.path.join(d, ext))
+    )[:limit]
+    for path in paths:
+        im_bgr = cv2.imread(path)
+        if im_bgr is not None:
+            yield [classifier_input(im_bgr)[None]]
+
+
+def export_tflite(keras_path=KERAS_CLASSIFIER_PATH, output_path=TFLITE_CLASSIFIER_PATH,
+                  calibration_dirs=CALIBRATION_DIRS):
+    """
+    Converts the Keras classifier to a quantized TFLite model.
+
+    With calibration images available, weights and activations are quantized to int8
+    (input and output stay float32, so callers feed the same tensors as to Keras).
+    Without them, only the weights are quantized (dynamic-range quantization).
+
+    Args:
+        keras_path (str): Path to the .h5 Keras model.
+        output_path (str): Where to write the .tflite model.
+        calibration_dirs (tuple): Directories of sample images for calibration.
+
+    Returns:
+        str: output_path.
+    """
+    import tensorflow as tf
+
+    model = tf.keras.models.load_model(keras_path)
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+
+    if next(iter(_calibration_images(calibration_dirs, 1)), None) is not None:
+        converter.representative_dataset = lambda: _calibration_images(calibration_dirs)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    else:
+        logging.warning("No calibration images found; exporting with dynamic-range quantization only")
+
+    tflite_model = converter.convert()
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, "wb") as f:
+        f.write(tflite_model)
+    logging.info(f"Exported TFLite classifier ({len(tflite_model) / 1e6:.1f} MB) to {output_path}")
+    return output_path
+
+
+class TFLiteClassifier:
+    """
+    The Ghibli/normal classifier served by the TFLite interpreter.
+
+    predict_batch is what the classifier service calls; predict mirrors Keras'
+    model.predict output shape ([N, 1]) for the single-image helpers. model_id is the
+    classifier_identity the service keys cached verdicts on.
+    """
+
+    def __init__(self, model_path=TFLITE_CLASSIFIER_PATH, num_threads=TFLITE_NUM_THREADS):
+        self.model_id = classifier_identity(model_path)
+        self.interpreter = _interpreter_class()(model_path=model_path, num_threads=num_threads)
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self._batch_size = int(self._input["shape"][0])
+
+    def _resize(self, batch_size):
+        """Resizes the interpreter's input to the batch size (only when it changes)."""
+        if batch_size != self._batch_size:
+            self.interpreter.resize_tensor_input(self._input["index"], [batch_size] + list(self._input["shape"][1:]))
+            self.interpreter.allocate_tensors()
+            self._input = self.interpreter.get_input_details()[0]
+            self._output = self.interpreter.get_output_details()[0]
+            self._batch_size = batch_size
+
+    def predict_batch(self, batch):
+        """
+        Args:
+            batch (numpy.ndarray): float32 [N, 224, 224, 3] inputs scaled to [0, 1].
+
+        Returns:
+            numpy.ndarray: N "normal" scores.
+        """
+        self._resize(len(batch))
+        dtype = self._input["dtype"]
+        if dtype != np.float32:
+            # Fully integer model: quantize the input with the model's own scale / zero point
+            scale, zero_point = self._input["quantization"]
+            batch = np.clip(np.round(batch / scale + zero_point), np.iinfo(dtype).min, np.iinfo(dtype).max)
+        self.interpreter.set_tensor(self._input["index"], batch.astype(dtype, copy=False))
+        self.interpreter.invoke()
+
+        scores = self.interpreter.get_tensor(self._output["index"])
+        if self._output["dtype"] != np.float32:
+            scale, zero_point = self._output["quantization"]
+            scores = (scores.astype(np.float32) - zero_point) * scale
+        return scores.reshape(-1)
+
+    def predict(self, batch, verbose=0):
+        return self.predict_batch(np.asarray(batch, dtype=np.float32)).reshape(-1, 1)
+
+
+register_model("classifier_tflite", TFLiteClassifier)
+
+
+def load_tflite_classifier():
+    """Returns the shared TFLite classifier, or None if it has not been exported yet."""
+    if not os.path.exists(TFLITE_CLASSIFIER_PATH):
+        return None
+    return get_model("classifier_tflite")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    export_tflite()
@@ -0,0 +1,86 @@
+import numpy as np
+
+# --- Configuration for tiled segmentation of very large images ---
+# The image is segmented in overlapping windows and the per-tile composite masks are
+# OR-ed into a bit-packed full-size mask (1 bit per pixel), so peak memory depends on
+# the tile size rather than on the input resolution. Only used when segmentor() is
+# called with max_side=None and full-resolution output; the default path downscales.
+TILE_SIZE = 1024
+TILE_OVERLAP = 128
+TILE_THRESHOLD_PIXELS = 4096 * 4096  # Full-resolution inputs above this are tiled
+
+
+def _tile_starts(length, tile_size, stride, align=1):
+    """Start offsets covering [0, length) with the given stride, aligned down to `align`."""
+    if length <= tile_size:
+        return [0]
+    last = (length - tile_size) // align * align
+    starts = list(range(0, last, stride))
+    starts.append(last)
+    return starts
+
+
+def iter_tiles(height, width, tile_size=TILE_SIZE, overlap=TILE_OVERLAP):
+    """
+    Yields (x0, y0, x1, y1) windows covering the image with at least `overlap` pixels of overlap.
+
+    Horizontal offsets are multiples of 8 so every tile maps onto whole bytes of the
+    packed mask. The last tile in each row/column is stretched to reach the image edge.
+    """
+    stride = max(8, (tile_size - overlap) // 8 * 8)
+    xs = _tile_starts(width, tile_size, stride, align=8)
+    ys = _tile_starts(height, tile_size, stride)
+    for i, y0 in enumerate(ys):
+        y1 = height if i == len(ys) - 1 else min(y0 + tile_size, height)
+        for j, x0 in enumerate(xs):
+            x1 = width if j == len(xs) - 1 else min(x0 + tile_size, width)
+            yield x0, y0, x1, y1
+
+
+def tiled_mask(im_bgr, predict_mask, tile_size=TILE_SIZE, overlap=TILE_OVERLAP):
+    """
+    Segments an image tile by tile and stitches the tile masks into one packed mask.
+
+    Args:
+        im_bgr (numpy.ndarray): The input image in BGR format.
+        predict_mask (callable): Segmentation backend, BGR tile -> boolean tile mask.
+        tile_size (int): Side of the square inference window.
+        overlap (int): Minimum overlap between neighbouring windows.
+
+    Returns:
+        numpy.ndarray: Bit-packed mask of shape [height, ceil(width / 8)] (see np.packbits).
+    """
+    height, width = im_bgr.shape[:2]
+    packed = np.zeros((height, (width + 7) // 8), dtype=np.uint8)
+
+    tiles = list(iter_tiles(height, width, tile_size, overlap))
+    for index, (x0, y0, x1, y1) in enumerate(tiles, start=1):
+        print(f"Segmenting tile {index}/{len(tiles)} at ({x0}, {y0})-({x1}, {y1})...")
+        tile_mask = predict_mask(im_bgr[y0:y1, x0:x1])
+        packed_tile = np.packbits(tile_mask, axis=1)
+        col = x0 // 8
+        packed[y0:y1, col:col + packed_tile.shape[1]] |= packed_tile
+    return packed
+
+
+def packed_profiles(packed, width):
+    """
+    Row and column occupancy of a packed mask, without unpacking it.
+
+    Returns:
+        tuple: (rows_any, cols_any) boolean vectors of length height and width.
+    """
+    rows_any = packed.any(axis=1)
+    cols_any = np.unpackbits(np.bitwise_or.reduce(packed, axis=0), count=width).astype(bool)
+    return rows_any, cols_any
+
+
+def unpack_region(packed, bbox):
+    """
+    Unpacks only the (x0, y0, x1, y1) region of a packed mask into a boolean array.
+    """
+    x0, y0, x1, y1 = bbox
+    col0, col1 = x0 // 8, (x1 + 7) // 8
+    bits = np.unpackbits(packed[y0:y1, col0:col1], axis=1)
+    offset = x0 - col0 * 8
+    return bits[:, offset:offset + (x1 - x0)].astype(bool)
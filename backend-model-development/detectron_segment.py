@@ -8,17 +8,22 @@ from detectron2.engine import DefaultPredictor
 # No need for Visualizer or MetadataCatalog if we're just getting masks
 
 # --- Configuration for the pre-trained Detectron2 model ---
-# Load this configuration once outside the function if segmenting many images
-# or load it inside if the script is just for one image at a time.
-# For a single script run, loading inside is fine.
-cfg = get_cfg()
-cfg.merge_from_file("detectron2/configs/COCO-InstanceSegmentation/mask_rcnn_R_50_FPN_3x.yaml")
-cfg.MODEL.ROI_HEADS.SCORE_THRESH_TEST = 0.7 # Set a higher threshold for cleaner results
-cfg.MODEL.DEVICE = "cpu" # !!! IMPORTANT FOR CPU !!!
-cfg.MODEL.WEIGHTS = "detectron2://COCO-InstanceSegmentation/mask_rcnn_R_50_FPN_3x/137849600/model_final_f10217.pkl"
-
-# Create the predictor once
-predictor = DefaultPredictor(cfg)
+# The predictor is built lazily on first use, so importing this module (e.g. from the
+# training scripts) does not pay the weight download and model construction cost.
+_predictor = None
+
+
+def get_predictor():
+    """Builds the Detectron2 predictor on first call and returns the shared instance."""
+    global _predictor
+    if _predictor is None:
+        cfg = get_cfg()
+        cfg.merge_from_file("detectron2/configs/COCO-InstanceSegmentation/mask_rcnn_R_50_FPN_3x.yaml")
+        cfg.MODEL.ROI_HEADS.SCORE_THRESH_TEST = 0.7 # Set a higher threshold for cleaner results
+        cfg.MODEL.DEVICE = "cpu" # !!! IMPORTANT FOR CPU !!!
+        cfg.MODEL.WEIGHTS = "detectron2://COCO-InstanceSegmentation/mask_rcnn_R_50_FPN_3x/137849600/model_final_f10217.pkl"
+        _predictor = DefaultPredictor(cfg)
+    return _predictor
 # --- End Configuration ---
 
 
@@ -49,7 +54,7 @@ def segment_and_isolate_to_webp(image_path, output_webp_path):
 
     # Run the predictor on the image
     print("Running inference (this may take a while on CPU!)...")
-    outputs = predictor(im_bgr)
+    outputs = get_predictor()(im_bgr)
     print("Inference complete.")
 
     # Extract instance predictions